@@ -20,7 +20,17 @@ app.conf.update(
         'default': {
             'exchange': 'default',
             'routing_key': 'default',
-        }
+        },
+        # process_upload is sent to one of these by folder size, see tasks.enqueue_upload;
+        # run them on separate workers so small uploads never wait behind large ones
+        'express': {
+            'exchange': 'express',
+            'routing_key': 'express',
+        },
+        'bulk': {
+            'exchange': 'bulk',
+            'routing_key': 'bulk',
+        },
     }
 )
 
@@ -25,6 +25,24 @@ env = environ.Env(
     REDIS_PORT=(int, 6379),
     MAX_UPLOAD_SIZE=(int, 5242880000),  # 5GB in bytes
     IRIDA_TIMEOUT=(int, 10),
+    IRIDA_API_POOL_SIZE=(int, 4),
+    IRIDA_TOKEN_REFRESH_SECONDS=(int, 1800),
+    IRIDA_PROJECT_INDEX_TTL=(int, 900),
+    IRIDA_UPLOAD_WORKERS=(int, 4),
+    IRIDA_SAMPLE_RETRIES=(int, 4),
+    FASTQ_VALIDATION_WORKERS=(int, 0),
+    MAX_CONCURRENT_UPLOADS=(int, 2),
+    UPLOAD_LEASE_SECONDS=(int, 300),
+    UPLOAD_HEARTBEAT_TIMEOUT=(int, 1800),
+    EXPRESS_UPLOAD_MAX_BYTES=(int, 10 * 1024 ** 3),
+    MAX_CONCURRENT_EXPRESS_UPLOADS=(int, 1),
+    UPLOAD_BANDWIDTH_LIMIT=(int, 0),
+    UPLOAD_USER_BANDWIDTH_LIMIT=(int, 0),
+    RUN_WATCH_AUTO_UPLOAD=(bool, False),
+    RUN_WATCH_POLL_SECONDS=(int, 60),
+    RUN_QUIESCENCE_SECONDS=(int, 600),
+    RUN_COMPLETE_MARKERS=(list, ['CopyComplete.txt', 'RunComplete.txt']),
+    EVENT_STREAM_LIMIT=(int, 16),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -233,7 +251,12 @@ CELERY_BROKER_CONNECTION_TIMEOUT = 30
 CELERY_BEAT_SCHEDULE = {
     'update-queue-notifications': {
         'task': 'uploader.tasks.update_queue_notifications',
-        'schedule': 5.0,  # Run every 30 seconds
+        # Queue transitions trigger updates; this only catches anything they missed
+        'schedule': 300.0,
+    },
+    'reap-stuck-uploads': {
+        'task': 'uploader.tasks.reap_stuck_uploads',
+        'schedule': 60.0,
     },
 }
 
@@ -262,6 +285,24 @@ IRIDA_CLIENT_SECRET = env('IRIDA_CLIENT_SECRET', default='')
 IRIDA_USERNAME = env('IRIDA_USERNAME', default='')
 IRIDA_PASSWORD = env('IRIDA_PASSWORD', default='')
 IRIDA_TIMEOUT = env('IRIDA_TIMEOUT')
+IRIDA_API_POOL_SIZE = env('IRIDA_API_POOL_SIZE')  # Authenticated clients kept per worker process
+IRIDA_TOKEN_REFRESH_SECONDS = env('IRIDA_TOKEN_REFRESH_SECONDS')  # Re-authenticate clients older than this
+IRIDA_PROJECT_INDEX_TTL = env('IRIDA_PROJECT_INDEX_TTL')  # Seconds before the project name index is fully refreshed
+IRIDA_UPLOAD_WORKERS = env('IRIDA_UPLOAD_WORKERS')  # Samples sent in parallel per upload
+IRIDA_SAMPLE_RETRIES = env('IRIDA_SAMPLE_RETRIES')  # Attempts per sample after the first, before the sample fails
+FASTQ_VALIDATION_WORKERS = env('FASTQ_VALIDATION_WORKERS')  # Threads checking fastq files before upload, 0 for one per core
+MAX_CONCURRENT_UPLOADS = env('MAX_CONCURRENT_UPLOADS')  # Uploads transferring at once across all workers
+UPLOAD_LEASE_SECONDS = env('UPLOAD_LEASE_SECONDS')  # Upload slot lease, renewed while the transfer runs
+UPLOAD_HEARTBEAT_TIMEOUT = env('UPLOAD_HEARTBEAT_TIMEOUT')  # Seconds without transfer progress before an upload is resumed elsewhere; must exceed the longest quiet phase, e.g. IRIDA creating the samples of a large run
+EXPRESS_UPLOAD_MAX_BYTES = env('EXPRESS_UPLOAD_MAX_BYTES')  # Folders up to this size go to the express queue
+MAX_CONCURRENT_EXPRESS_UPLOADS = env('MAX_CONCURRENT_EXPRESS_UPLOADS')  # Express transfers at once, on top of MAX_CONCURRENT_UPLOADS
+UPLOAD_BANDWIDTH_LIMIT = env('UPLOAD_BANDWIDTH_LIMIT')  # Bytes/s of all uploads together, 0 for unlimited; overridden in the admin
+UPLOAD_USER_BANDWIDTH_LIMIT = env('UPLOAD_USER_BANDWIDTH_LIMIT')  # Bytes/s of each user's uploads, 0 for unlimited; overridden in the admin
+RUN_WATCH_AUTO_UPLOAD = env('RUN_WATCH_AUTO_UPLOAD')  # Queue complete run folders found by watch_runs instead of only notifying
+RUN_WATCH_POLL_SECONDS = env('RUN_WATCH_POLL_SECONDS')  # Seconds between watch_runs polls of UPLOAD_ROOT
+RUN_QUIESCENCE_SECONDS = env('RUN_QUIESCENCE_SECONDS')  # A run folder whose fastq files did not change for this long is complete
+RUN_COMPLETE_MARKERS = env('RUN_COMPLETE_MARKERS')  # Files marking a run folder complete straight away
+EVENT_STREAM_LIMIT = env('EVENT_STREAM_LIMIT')  # Open dashboard event streams per web process, keep below its threads; other dashboards poll
 
 # LDAP Settings
 USE_LDAP = os.environ.get('USE_LDAP', 'False').lower() == 'true'
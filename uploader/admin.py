@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Upload, Notification
+from .models import User, Upload, Notification, IridaProject, BandwidthLimit, UploadedFile
 
 class UploadAdmin(admin.ModelAdmin):
     list_display = ('folder_name', 'project_name', 'user', 'status', 'sample_count', 'uploaded_samples','irida_project_id', 'created_at')
@@ -12,6 +12,22 @@ class NotificationAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('user__username',)
 
+class IridaProjectAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project_id', 'refreshed_at')
+    search_fields = ('name', 'project_id')
+
+class UploadedFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'project_id', 'sample_name', 'sample_id', 'size', 'uploaded_at')
+    list_filter = ('project_id',)
+    search_fields = ('path', 'sample_name', 'sha256')
+
+class BandwidthLimitAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'user', 'bytes_per_second')
+    search_fields = ('user__email',)
+
 admin.site.register(User)
 admin.site.register(Upload, UploadAdmin)
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(IridaProject, IridaProjectAdmin)
+admin.site.register(BandwidthLimit, BandwidthLimitAdmin)
+admin.site.register(UploadedFile, UploadedFileAdmin)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+LIMITS_KEY = 'iuw:bandwidth-limits'
+BUCKET_KEY = 'iuw:bandwidth:{scope}'
+BURST_SECONDS = 1  # Bucket capacity, in seconds of the limit
+QUANTUM = 256 * 1024  # Bytes sent between draws from the shared buckets
+LIMITS_REFRESH = 10  # Seconds a worker keeps using limits before reading them again
+
+# Buckets go into debt: a draw always succeeds and returns how long the caller
+# must pause until every bucket is back above zero. This accepts reads of any
+# size and needs one round trip per draw. Timestamps come from the Redis clock.
+_DRAW = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + tonumber(now[2]) / 1000
+local amount = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i + 1])
+    local capacity = rate * tonumber(ARGV[#KEYS + 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now_ms
+    tokens = math.min(capacity, tokens + (now_ms - ts) * rate / 1000) - amount
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now_ms))
+    redis.call('PEXPIRE', key, 60000)
+    if tokens < 0 then
+        wait = math.max(wait, -tokens * 1000 / rate)
+    end
+end
+return math.ceil(wait)
+"""
+
+
+def sync_limits():
+    """Copy the BandwidthLimit rows to Redis, where every worker reads them from.
+
+    Runs whenever a limit changes and when a transfer starts, which restores
+    the copy should Redis have lost it.
+    """
+    from .models import BandwidthLimit  # models imports this module
+
+    limits = {
+        'global' if limit.user_id is None else f"user:{limit.user_id}": limit.bytes_per_second
+        for limit in BandwidthLimit.objects.all()
+    }
+    pipe = get_redis().pipeline()
+    pipe.delete(LIMITS_KEY)
+    if limits:
+        pipe.hset(LIMITS_KEY, mapping=limits)
+    pipe.execute()
+    return limits
+
+
+def current_limits(user_id):
+    """(global, per user) limits in bytes per second for uploads of ``user_id``; 0 means unlimited."""
+    stored = get_redis().hgetall(LIMITS_KEY)
+    limits = {field.decode(): int(value) for field, value in stored.items()}
+    return (
+        limits.get('global', settings.UPLOAD_BANDWIDTH_LIMIT),
+        limits.get(f"user:{user_id}", settings.UPLOAD_USER_BANDWIDTH_LIMIT),
+    )
+
+
+class Throttle:
+    """Paces the bytes one upload reads to the global and per-user limits shared by all workers.
+
+    Every sample thread of the upload reports what it read with ``consume``;
+    once ``QUANTUM`` bytes add up they are drawn from the Redis buckets and the
+    calling thread sleeps for as long as the buckets are in debt. If Redis is
+    unreachable uploads run unthrottled rather than fail.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._buckets = []
+        self._checked = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < LIMITS_REFRESH:
+            return
+        self._checked = now
+        global_limit, user_limit = current_limits(self.user_id)
+        self._buckets = [
+            (BUCKET_KEY.format(scope=scope), rate)
+            for scope, rate in (('global', global_limit), (f"user:{self.user_id}", user_limit))
+            if rate > 0
+        ]
+
+    def consume(self, nbytes):
+        with self._lock:
+            self._pending += nbytes
+            if self._pending < QUANTUM:
+                return
+            amount, self._pending = self._pending, 0
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning(f"Could not read bandwidth limits: {str(e)}")
+            buckets = list(self._buckets)
+        if not buckets:
+            return
+
+        try:
+            keys = [key for key, _ in buckets]
+            wait_ms = get_redis().eval(_DRAW, len(keys), *keys, amount,
+                                       *[rate for _, rate in buckets], BURST_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not draw from bandwidth buckets: {str(e)}")
+            return
+        if wait_ms > 0:
+            time.sleep(wait_ms / 1000)
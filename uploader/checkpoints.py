@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE_NAME = '.iuw_checkpoints.json'
+PERSIST_BYTES = 64 * 1024 * 1024  # Progress is written to disk every 64 MB sent
+
+
+class CheckpointStore:
+    """Per-file transfer checkpoints for one run directory.
+
+    For every sequence file sent to IRIDA the store records its size and mtime,
+    the bytes handed to the HTTP connection so far, the MD5 and SHA-256 of the
+    whole file once it was sent in full, and whether IRIDA acknowledged the
+    file. Hashes are taken from the buffers being sent, so checkpointing costs
+    no extra reads.
+    The store is persisted next to ``irida_uploader_status.info``.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, CHECKPOINT_FILE_NAME)
+        self._lock = threading.Lock()
+        self._files = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get('files', {})
+        except FileNotFoundError:
+            return {}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint file {self.path}: {str(e)}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self._files}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, path):
+        with self._lock:
+            entry = self._files.get(path)
+            return dict(entry) if entry else None
+
+    def is_confirmed(self, path, run_id):
+        """True if IRIDA acknowledged ``path`` for ``run_id`` and the file is unchanged since."""
+        entry = self.get(path)
+        if not entry or not entry.get('confirmed') or entry.get('run_id') != str(run_id):
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns
+
+    def _start(self, path, run_id):
+        st = os.stat(path)
+        with self._lock:
+            previous = self._files.get(path)
+            if (previous and previous.get('run_id') == str(run_id)
+                    and previous.get('bytes_sent') and not previous.get('confirmed')):
+                logger.info(f"Resending {os.path.basename(path)}, {previous['bytes_sent']} of "
+                            f"{previous['size']} bytes were sent before the last interruption")
+            self._files[path] = {
+                'run_id': str(run_id),
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'bytes_sent': 0,
+                'confirmed': False,
+            }
+            self._save()
+
+    def _record(self, reader, persist):
+        with self._lock:
+            entry = self._files.get(reader.path)
+            if entry is None:
+                return
+            entry['bytes_sent'] = reader.bytes_read
+            if reader.digests:
+                entry.update(reader.digests)
+            if persist:
+                self._save()
+
+    def confirm(self, paths):
+        """Mark ``paths`` as acknowledged by IRIDA."""
+        with self._lock:
+            for path in paths:
+                entry = self._files.get(path)
+                if entry is not None:
+                    entry['bytes_sent'] = entry['size']
+                    entry['confirmed'] = True
+            self._save()
+
+    def checksums(self, directory):
+        """MD5 and SHA-256 of every acknowledged file that is unchanged since, keyed by path relative to ``directory``."""
+        with self._lock:
+            entries = {path: dict(entry) for path, entry in self._files.items()
+                       if entry.get('confirmed') and entry.get('sha256')}
+        result = {}
+        for path, entry in entries.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+                result[os.path.relpath(path, directory)] = {
+                    'size': entry['size'], 'md5': entry['md5'], 'sha256': entry['sha256'],
+                }
+        return result
+
+    @contextmanager
+    def transfer(self, paths, run_id, throttle=None, heartbeat=None):
+        """Yield an opener for ``paths`` that checkpoints every read; readers are closed on exit.
+
+        Reads are paced by ``throttle`` if given, see bandwidth.Throttle, and
+        signal progress to ``heartbeat``, see heartbeats.Heartbeat.
+        """
+        for path in paths:
+            self._start(path, run_id)
+        readers = []
+
+        def opener(path):
+            reader = CheckpointedReader(path, self, throttle, heartbeat)
+            readers.append(reader)
+            return reader
+
+        try:
+            yield opener
+        finally:
+            for reader in readers:
+                reader.close()
+
+
+class CheckpointedReader:
+    """Binary file wrapper that reports bytes read to a CheckpointStore.
+
+    The MD5 and SHA-256 of the whole file are computed from the same buffers and
+    set in ``digests`` once the file was read to the end.
+    """
+
+    def __init__(self, path, store, throttle=None, heartbeat=None):
+        self.path = path
+        self._store = store
+        self._throttle = throttle
+        self._heartbeat = heartbeat
+        self._fh = open(path, 'rb')
+        self.size = os.fstat(self._fh.fileno()).st_size
+        self.bytes_read = 0
+        self._persisted = 0
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self.digests = None
+
+    def read(self, size=-1):
+        data = self._fh.read(size)
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.bytes_read += len(data)
+        persist = self.bytes_read - self._persisted >= PERSIST_BYTES
+        # The encoder stops reading at the expected length, so the digests are taken here
+        if self.bytes_read == self.size and self.digests is None:
+            self.digests = {'md5': self._md5.hexdigest(), 'sha256': self._sha256.hexdigest()}
+            persist = True
+        if persist:
+            self._persisted = self.bytes_read
+        self._store._record(self, persist)
+        if self._heartbeat:
+            self._heartbeat.beat()
+        if self._throttle and data:
+            self._throttle.consume(len(data))
+        return data
+
+    def tell(self):
+        return self._fh.tell()
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        self._fh.close()
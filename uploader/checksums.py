@@ -0,0 +1,32 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Size, MD5 and SHA-256 of ``path`` from a single read of the file."""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            md5.update(block)
+            sha256.update(block)
+            size += len(block)
+    return {'size': size, 'md5': md5.hexdigest(), 'sha256': sha256.hexdigest()}
+
+
+def hash_files(directory, paths, workers=4):
+    """Checksums of ``paths`` keyed by path relative to ``directory``.
+
+    hashlib releases the GIL on large buffers, so threads hash files in parallel
+    while others wait on the file system.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='checksum') as executor:
+        digests = executor.map(hash_file, paths)
+        return {os.path.relpath(path, directory): digest for path, digest in zip(paths, digests)}
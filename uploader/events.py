@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+USER_CHANNEL = 'iuw:events:user:{user_id}'
+QUEUE_CHANNEL = 'iuw:events:queue'
+STREAM_SECONDS = 30  # Streams are closed after this long and the browser reconnects
+KEEPALIVE_SECONDS = 15
+LOG_EVENT_INTERVAL = 1.0  # At most one log event per upload per second
+
+_last_log_event = {}
+_last_log_event_lock = threading.Lock()
+# Each open stream holds a server thread and a Redis connection for its whole life
+_stream_slots = threading.BoundedSemaphore(settings.EVENT_STREAM_LIMIT)
+
+
+def publish(channel, event, data):
+    """Publish an event; progress events are best effort and never fail the caller."""
+    try:
+        get_redis().publish(channel, json.dumps({'event': event, 'data': data}))
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish {event} event: {str(e)}")
+
+
+def upload_snapshot(upload):
+    return {
+        'id': upload.id,
+        'status': upload.status,
+        'sample_count': upload.sample_count,
+        'irida_project_id': upload.irida_project_id or '-',
+        'run_id': upload.irida_run_id,
+    }
+
+
+def publish_upload(upload, queue_changed=False):
+    publish(USER_CHANNEL.format(user_id=upload.user_id), 'upload', upload_snapshot(upload))
+    if queue_changed:
+        publish(QUEUE_CHANNEL, 'queue', {})
+
+
+def publish_progress(user_id, upload_id, uploaded, total, eta=None):
+    publish(USER_CHANNEL.format(user_id=user_id), 'progress', {
+        'id': upload_id,
+        'sample_progress': {'uploaded': uploaded, 'total': total},
+        'eta': eta,
+    })
+
+
+def publish_log(user_id, upload_id):
+    """Tell the browser the upload log grew; it fetches the new lines from its offset."""
+    now = time.monotonic()
+    with _last_log_event_lock:
+        if now - _last_log_event.get(upload_id, 0) < LOG_EVENT_INTERVAL:
+            return
+        _last_log_event[upload_id] = now
+    publish(USER_CHANNEL.format(user_id=user_id), 'log', {'id': upload_id})
+
+
+def forget_log(upload_id):
+    """Drop the log event throttle of an upload that finished in this process."""
+    with _last_log_event_lock:
+        _last_log_event.pop(upload_id, None)
+
+
+def _format(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def subscribe(user_id):
+    """Subscribe to the events of ``user_id``; raises redis.RedisError if Redis is unreachable."""
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(USER_CHANNEL.format(user_id=user_id), QUEUE_CHANNEL)
+    except redis.RedisError:
+        pubsub.close()
+        raise
+    return pubsub
+
+
+class EventStream:
+    """Server-sent events of one user for a StreamingHttpResponse, see ``open_stream``.
+
+    The response closes it when the request ends, which gives back its slot and
+    Redis connection even if the stream was never iterated.
+    """
+
+    def __init__(self, pubsub, initial=()):
+        self._pubsub = pubsub
+        self._events = stream(pubsub, initial)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._events.close()
+        self._pubsub.close()
+        _stream_slots.release()
+
+
+def open_stream(user_id, initial=()):
+    """EventStream of ``user_id``, or None if this process already serves EVENT_STREAM_LIMIT streams.
+
+    Raises redis.RedisError if Redis is unreachable.
+    """
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    try:
+        return EventStream(subscribe(user_id), initial)
+    except BaseException:
+        _stream_slots.release()
+        raise
+
+
+def stream(pubsub, initial=(), duration=STREAM_SECONDS):
+    """Yield server-sent events from ``pubsub`` for up to ``duration`` seconds.
+
+    ``initial`` events are sent first so a (re)connecting browser starts from the
+    current state. Only events published while connected are delivered after that.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        for event, data in initial:
+            yield _format(event, data)
+
+        deadline = time.monotonic() + duration
+        last_sent = time.monotonic()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(timeout=min(remaining, KEEPALIVE_SECONDS))
+            if message is None:
+                if time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+                continue
+            try:
+                payload = json.loads(message['data'])
+            except (TypeError, ValueError):
+                continue
+            yield _format(payload['event'], payload['data'])
+            last_sent = time.monotonic()
+    except redis.RedisError as e:
+        logger.warning(f"Event stream stopped: {str(e)}")
+    finally:
+        pubsub.close()
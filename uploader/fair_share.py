@@ -0,0 +1,69 @@
+import time
+
+from django.db.models import Count
+
+from .models import Upload
+from .redis_client import get_redis
+
+WAITING_KEY = 'iuw:upload-waiting'
+
+
+def fair_order(queued, running_counts=None):
+    """Order queued uploads round-robin across users.
+
+    Every user's oldest queued upload comes first, then every user's second,
+    and so on, with ties broken by submission time. Uploads a user already has
+    running count as earlier turns, so a user with a transfer in progress goes
+    behind users who have none.
+    """
+    running_counts = running_counts or {}
+    turns = {}
+    keyed = []
+    for upload in sorted(queued, key=lambda u: (u.created_at, u.id)):
+        turn = turns.get(upload.user_id, running_counts.get(upload.user_id, 0))
+        turns[upload.user_id] = turn + 1
+        keyed.append((turn, upload.created_at, upload.id, upload))
+    keyed.sort(key=lambda k: k[:3])
+    return [k[3] for k in keyed]
+
+
+def running_counts(queue=None):
+    uploads = Upload.objects.filter(status='uploading')
+    if queue:
+        uploads = uploads.filter(queue=queue)
+    return dict(
+        uploads
+        .values_list('user_id')
+        .annotate(n=Count('id'))
+    )
+
+
+def _waiting_key(queue):
+    return f"{WAITING_KEY}:{queue}"
+
+
+def mark_waiting(upload_id, queue):
+    """Record that the task of ``upload_id`` is at the slot gate of ``queue`` now."""
+    get_redis().zadd(_waiting_key(queue), {str(upload_id): time.time()})
+
+
+def clear_waiting(upload_id, queue):
+    get_redis().zrem(_waiting_key(queue), str(upload_id))
+
+
+def dispatch_allowed(upload_id, queue, free_slots, max_age):
+    """True if ``upload_id`` is among the next ``free_slots`` uploads of ``queue`` in fair-share order.
+
+    Only uploads whose task reached the slot gate within ``max_age`` seconds
+    compete, so an upload that is still preparing or whose task was lost does
+    not hold up the others.
+    """
+    if free_slots <= 0:
+        return False
+    redis = get_redis()
+    key = _waiting_key(queue)
+    redis.zremrangebyscore(key, '-inf', time.time() - max_age)
+    waiting = [int(member) for member in redis.zrange(key, 0, -1)]
+    queued = Upload.objects.filter(id__in=waiting, status='submitted').only('id', 'user_id', 'created_at')
+    ahead = [upload.id for upload in fair_order(queued, running_counts(queue))][:free_slots]
+    return upload_id in ahead
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_FILE_NAME = '.iuw_validation.json'
+READ_SIZE = 1024 * 1024  # Compressed bytes inflated at a time
+
+
+class FastqValidationError(Exception):
+    """One or more fastq files of a run are truncated, corrupt or not FASTQ."""
+
+    def __init__(self, errors):
+        self.errors = errors  # {path: message}
+        listed = '; '.join(f"{os.path.basename(path)}: {message}" for path, message in sorted(errors.items()))
+        super().__init__(f"{len(errors)} fastq file(s) failed validation: {listed}")
+
+
+def _check_records(lines, first_record):
+    """Check complete 4-line records; returns an error message or None.
+
+    The checks run through ``map`` over whole slices so a chunk of records is
+    checked without a Python-level loop per record.
+    """
+    headers, seqs, separators, quals = lines[0::4], lines[1::4], lines[2::4], lines[3::4]
+    if (all(map(bytes.startswith, headers, repeat(b'@')))
+            and all(map(bytes.startswith, separators, repeat(b'+')))
+            and list(map(len, seqs)) == list(map(len, quals))):
+        return None
+    # Slow path, only to name the first bad record
+    for i, (header, seq, separator, qual) in enumerate(zip(headers, seqs, separators, quals)):
+        record = first_record + i + 1
+        if not header.startswith(b'@'):
+            return f"record {record} does not start with '@'"
+        if not separator.startswith(b'+'):
+            return f"record {record} has no '+' separator line"
+        if len(seq) != len(qual):
+            return f"record {record} has {len(seq)} bases but {len(qual)} quality scores"
+    return None
+
+
+def validate_file(path):
+    """Stream ``path`` once, checking every gzip member's CRC and length and the FASTQ records.
+
+    Returns ``(reads, error)``; ``error`` is None for a valid file. Concatenated
+    gzip members (e.g. BGZF) are followed, trailing zero padding is allowed.
+    """
+    reads = 0
+    carry = b''
+    inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    in_member = False
+    try:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(READ_SIZE), b''):
+                out = []
+                while chunk:
+                    if not in_member and chunk[:1] == b'\0' and not chunk.strip(b'\0'):
+                        break
+                    in_member = True
+                    out.append(inflater.decompress(chunk))
+                    if inflater.eof:
+                        # The trailer's CRC-32 and size matched; another member may follow
+                        chunk = inflater.unused_data
+                        inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                        in_member = False
+                    else:
+                        chunk = b''
+
+                lines = (carry + b''.join(out)).split(b'\n')
+                carry = lines.pop()
+                complete = len(lines) - len(lines) % 4
+                error = _check_records(lines[:complete], reads)
+                if error:
+                    return reads, error
+                reads += complete // 4
+                if complete < len(lines):
+                    carry = b'\n'.join(lines[complete:] + [carry])
+    except zlib.error as e:
+        return reads, f"corrupt gzip data after {reads} reads ({str(e)})"
+    except OSError as e:
+        return reads, f"cannot be read ({str(e)})"
+
+    if in_member:
+        return reads, f"truncated: gzip stream ends after {reads} reads without its trailer"
+    if carry:
+        # A last record without a final newline
+        lines = carry.split(b'\n')
+        if len(lines) % 4:
+            return reads, f"truncated: last record after {reads} reads is incomplete"
+        error = _check_records(lines, reads)
+        if error:
+            return reads, error
+        reads += len(lines) // 4
+    if reads == 0:
+        return reads, "contains no reads"
+    return reads, None
+
+
+def _validate(path):
+    st = os.stat(path)
+    reads, error = validate_file(path)
+    return path, st.st_size, st.st_mtime_ns, reads, error
+
+
+class ValidationCache:
+    """Validation results of one run directory, keyed by path and valid while size and mtime match.
+
+    The cache is persisted next to ``irida_uploader_status.info``, so files are
+    only read again after they changed.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, VALIDATION_FILE_NAME)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                self.files = json.load(f).get('files', {})
+        except FileNotFoundError:
+            self.files = {}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable validation cache {self.path}: {str(e)}")
+            self.files = {}
+
+    def get(self, path):
+        """The cached ``{'reads', 'error'}`` of ``path`` if it is unchanged since, else None."""
+        entry = self.files.get(path)
+        if not entry:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+            return None
+        return entry
+
+    def put(self, path, size, mtime, reads, error):
+        with self._lock:
+            self.files[path] = {'size': size, 'mtime': mtime, 'reads': reads, 'error': error}
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with self._lock, open(tmp_path, 'w') as f:
+            json.dump({'files': self.files}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def validate_run(directory, paths, workers=None):
+    """Validate ``paths`` of the run in ``directory`` with ``workers`` threads.
+
+    Threads rather than processes, as Celery's prefork workers are daemonic and
+    may not start child processes; reads and zlib release the GIL. Unchanged
+    files validated before are not read again. Returns the number of reads per
+    path; raises FastqValidationError listing every bad file.
+    """
+    cache = ValidationCache(directory)
+    results = {}
+    todo = []
+    for path in paths:
+        entry = cache.get(path)
+        if entry is None:
+            todo.append(path)
+        else:
+            results[path] = (entry['reads'], entry['error'])
+
+    if todo:
+        logger.info(f"Validating {len(todo)} fastq files, {len(results)} unchanged since their last check")
+        workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fastq-check') as executor:
+                # Largest first, so a big file does not start last and hold up the end
+                todo.sort(key=lambda p: os.path.getsize(p), reverse=True)
+                for path, size, mtime, reads, error in executor.map(_validate, todo):
+                    cache.put(path, size, mtime, reads, error)
+                    results[path] = (reads, error)
+        finally:
+            cache.save()
+
+    errors = {path: error for path, (reads, error) in results.items() if error}
+    if errors:
+        raise FastqValidationError(errors)
+    return {path: reads for path, (reads, error) in results.items()}
@@ -0,0 +1,62 @@
+import logging
+import os
+
+from django.utils import timezone
+
+from . import checksums
+from .models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+def unchanged(project_id, directory, paths, workers=4):
+    """Index entries of ``paths`` already sent to ``project_id`` whose content is unchanged, keyed by path.
+
+    A file with the indexed size and mtime is taken as unchanged. One whose size
+    matches but whose mtime does not, e.g. after being copied again, is hashed
+    and compared by SHA-256; if it matches, the new mtime is indexed so the file
+    is not hashed again.
+    """
+    entries = {entry.path: entry for entry in UploadedFile.objects.filter(project_id=str(project_id), path__in=paths)}
+    result = {}
+    touched = {}
+    for path, entry in entries.items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_size != entry.size:
+            continue
+        if st.st_mtime_ns == entry.mtime_ns:
+            result[path] = entry
+        else:
+            touched[path] = st.st_mtime_ns
+
+    if touched:
+        logger.info(f"Hashing {len(touched)} files whose mtime changed since they were sent")
+        digests = checksums.hash_files(directory, list(touched), workers=workers)
+        moved = []
+        for path, mtime_ns in touched.items():
+            entry = entries[path]
+            if digests[os.path.relpath(path, directory)]['sha256'] == entry.sha256:
+                entry.mtime_ns = mtime_ns
+                moved.append(entry)
+                result[path] = entry
+        UploadedFile.objects.bulk_update(moved, ['mtime_ns'])
+    return result
+
+
+def record(project_id, files):
+    """Index ``files`` as sent to ``project_id``, replacing what was indexed for their paths.
+
+    ``files`` are dicts with the path, size, mtime_ns and sha256 of each file and
+    the sample_name, sample_id, sequencing_object_id and run_id it was sent to.
+    """
+    now = timezone.now()
+    UploadedFile.objects.bulk_create(
+        [UploadedFile(project_id=str(project_id), uploaded_at=now, **fields) for fields in files],
+        update_conflicts=True,
+        unique_fields=['project_id', 'path'],
+        update_fields=['size', 'mtime_ns', 'sha256', 'sample_name', 'sample_id',
+                       'sequencing_object_id', 'run_id', 'uploaded_at'],
+    )
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import time
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'iuw:folders:{user_id}'
+INDEX_EXPIRE = 24 * 60 * 60  # Listings of folders nobody opened for a day are dropped
+SETTLE_NS = 2 * 10**9  # NFS may keep mtimes in whole seconds; a folder changed this recently is not cached
+
+
+def resolve(user_dir, rel_path):
+    """Normalised ``rel_path`` and its absolute path in ``user_dir``; ValueError if it points outside of it."""
+    rel_path = os.path.normpath(rel_path or '.')
+    if os.path.isabs(rel_path) or rel_path == '..' or rel_path.startswith('..' + os.sep):
+        raise ValueError(f"Invalid folder: {rel_path}")
+    return rel_path, os.path.join(user_dir, rel_path)
+
+
+def _scan(path):
+    with os.scandir(path) as entries:
+        # Symlinked folders are left out, as os.walk did
+        return sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+def subfolders(user_id, user_dir, rel_path='.'):
+    """Names of the folders directly inside ``rel_path`` of the user's upload directory.
+
+    Only one level is listed, so run folders with thousands of subfolders are
+    not walked until someone expands them. Listings are cached per user in
+    Redis next to the folder's mtime, which changes whenever an entry is added,
+    removed or renamed in it; a cached listing costs one stat instead of a
+    directory read.
+    """
+    rel_path, path = resolve(user_dir, rel_path)
+    mtime = os.stat(path).st_mtime_ns
+    key = INDEX_KEY.format(user_id=user_id)
+
+    try:
+        cached = get_redis().hget(key, rel_path)
+        if cached is not None:
+            entry = json.loads(cached)
+            if entry['mtime'] == mtime:
+                return entry['folders']
+    except Exception as e:
+        logger.warning(f"Could not read folder index of user {user_id}: {str(e)}")
+
+    folders = _scan(path)
+    if time.time_ns() - mtime < SETTLE_NS:
+        # Another change within the same mtime tick would go unnoticed
+        return folders
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(key, rel_path, json.dumps({'mtime': mtime, 'folders': folders}))
+        pipe.expire(key, INDEX_EXPIRE)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not store folder index of user {user_id}: {str(e)}")
+    return folders
@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+HEARTBEATS_KEY = 'iuw:upload-heartbeats'
+BEAT_INTERVAL = 15  # Seconds between writes, however often beat() is called
+
+
+class Heartbeat:
+    """Last sign of progress of a running upload, kept in a Redis sorted set scored by time.
+
+    ``beat`` is called where the transfer makes progress: on every read of a file
+    being sent, when a sample is done and while a sample waits for its retry. A
+    heartbeat therefore stops both when the worker dies and when the transfer
+    hangs. Phases that make no progress, such as IRIDA creating the samples of a
+    large run, must end within UPLOAD_HEARTBEAT_TIMEOUT.
+    """
+
+    def __init__(self, upload_id, interval=BEAT_INTERVAL):
+        self.member = str(upload_id)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last = 0
+
+    def beat(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last < self.interval:
+                return
+            self._last = now
+        try:
+            get_redis().zadd(HEARTBEATS_KEY, {self.member: now})
+        except Exception as e:
+            logger.warning(f"Could not record heartbeat of upload {self.member}: {str(e)}")
+
+    def start(self):
+        """Beat now, whatever the interval; the transfer may take a while to read its first bytes."""
+        with self._lock:
+            self._last = 0
+        self.beat()
+
+    def wait(self, event, seconds):
+        """``event.wait(seconds)`` that beats meanwhile, for a pause the transfer makes on purpose."""
+        deadline = time.monotonic() + seconds
+        while True:
+            self.beat()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return event.is_set()
+            if event.wait(min(remaining, self.interval)):
+                return True
+
+    def stop(self):
+        try:
+            get_redis().zrem(HEARTBEATS_KEY, self.member)
+        except Exception as e:
+            logger.warning(f"Could not clear heartbeat of upload {self.member}: {str(e)}")
+
+
+def last_beats():
+    """Time of the last heartbeat of every running upload, keyed by upload id."""
+    return {int(member): score for member, score in get_redis().zrange(HEARTBEATS_KEY, 0, -1, withscores=True)}
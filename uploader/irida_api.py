@@ -0,0 +1,215 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+import iridauploader.api as irida_api_calls
+from iridauploader.core import api_handler
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+
+logger = logging.getLogger(__name__)
+
+
+def _settings_dict():
+    return {
+        "base_url": settings.IRIDA_API_URL,
+        "client_id": settings.IRIDA_CLIENT_ID,
+        "client_secret": settings.IRIDA_CLIENT_SECRET,
+        "username": settings.IRIDA_USERNAME,
+        "password": settings.IRIDA_PASSWORD,
+        "timeout_multiplier": settings.IRIDA_TIMEOUT,
+    }
+
+
+class UploaderApiCalls(irida_api_calls.ApiCalls):
+    """ApiCalls that lets the caller choose how sequence files are opened for sending.
+
+    When ``open_sequence_file`` is set it is called with each file path and must
+    return a binary file object; this is how transfers are checkpointed.
+    """
+
+    open_sequence_file = None
+
+    def _reinitialize_session(self):
+        super()._reinitialize_session()
+        # urllib3 would resend a POST after a failure, but it cannot rewind the
+        # multipart stream of a sequence file and would send a drained body.
+        # parallel_upload retries the whole sample instead.
+        for adapter in self._session_instance.adapters.values():
+            adapter.max_retries = adapter.max_retries.new(
+                allowed_methods=[method for method in adapter.max_retries.allowed_methods if method != 'POST']
+            )
+
+    def _get_sequence_data_pkg(self, sequence_file, upload_id):
+        if self.open_sequence_file is None:
+            return super()._get_sequence_data_pkg(sequence_file, upload_id)
+
+        # Same multipart layout as ApiCalls._get_multipart_encoder, which opens files itself
+        file_metadata = sequence_file.properties_dict
+        file_metadata["miseqRunId"] = str(upload_id)
+        file_metadata_json = str(json.dumps(file_metadata))
+        file_list = sequence_file.file_list
+        if sequence_file.is_paired_end():
+            fields = {
+                'file1': (file_list[0].replace("\\", "/"), self.open_sequence_file(file_list[0])),
+                'file2': (file_list[1].replace("\\", "/"), self.open_sequence_file(file_list[1])),
+                'parameters1': (None, file_metadata_json, 'application/json'),
+                'parameters2': (None, file_metadata_json, 'application/json'),
+            }
+        else:
+            fields = {
+                'file': (file_list[0].replace("\\", "/"), self.open_sequence_file(file_list[0])),
+                'parameters': (None, file_metadata_json, 'application/json'),
+            }
+        encoder = MultipartEncoder(fields=fields, boundary="B0undary")
+
+        monitor = MultipartEncoderMonitor(encoder, self._send_file_callback)
+        # Keep the library's 1 MB read size override
+        monitor._read = monitor.read
+        monitor.read = lambda size: monitor._read(1024 * 1024)
+        return monitor
+
+
+class IridaClientPool:
+    """Worker-scoped pool of authenticated IRIDA API clients.
+
+    Each client is authenticated once and keeps its OAuth2 session, and with it
+    the keep-alive connections, between tasks. Clients whose token is older than
+    ``refresh_after`` seconds get a fresh session before being handed out, so an
+    upload never starts on a token that is about to expire. At most ``size``
+    clients are created; callers beyond that wait for one to be returned.
+    """
+
+    def __init__(self, settings_dict, size=1, refresh_after=1800):
+        self.settings_dict = settings_dict
+        self.size = max(1, size)
+        self.refresh_after = refresh_after
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._config_path = None
+
+    def _new_client(self):
+        logger.info("Authenticating new IRIDA API client")
+        return UploaderApiCalls(**self.settings_dict)
+
+    def _checkout(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._new_client(), time.monotonic()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get(timeout=timeout)
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def client(self, timeout=None):
+        """Borrow a client for the duration of the ``with`` block."""
+        api, authenticated_at = self._checkout(timeout)
+        if time.monotonic() - authenticated_at > self.refresh_after:
+            logger.info("Refreshing IRIDA API token before expiry")
+            try:
+                with api._session_lock:
+                    api._reinitialize_session()
+            except Exception:
+                self._discard()
+                raise
+            authenticated_at = time.monotonic()
+        # ApiCalls caches projects and samples for the lifetime of the instance;
+        # those caches must not outlive a single task or other workers' changes are missed
+        api.cached_projects = None
+        api.cached_samples = {}
+        try:
+            yield api
+        finally:
+            self._idle.put((api, authenticated_at))
+
+    @property
+    def config_path(self):
+        """Path of the iridauploader config file, written once per process."""
+        with self._lock:
+            if self._config_path is None:
+                fd, path = tempfile.mkstemp(prefix="iuw-irida-", suffix=".conf")
+                with os.fdopen(fd, 'w') as f:
+                    f.write("[Settings]\n")
+                    f.write(f"base_url = {self.settings_dict['base_url']}\n")
+                    f.write(f"client_id = {self.settings_dict['client_id']}\n")
+                    f.write(f"client_secret = {self.settings_dict['client_secret']}\n")
+                    f.write(f"username = {self.settings_dict['username']}\n")
+                    f.write(f"password = {self.settings_dict['password']}\n")
+                    f.write(f"timeout = {self.settings_dict['timeout_multiplier']}\n")
+                atexit.register(_remove_quietly, path)
+                logger.info(f"Created IRIDA config file at: {path}")
+                self._config_path = path
+            return self._config_path
+
+
+def _remove_quietly(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the pool for the current process.
+
+    Celery's prefork workers fork after import, so the pool is keyed on the pid
+    to avoid sharing sockets between processes.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = IridaClientPool(
+                _settings_dict(),
+                # The task holds one client while each parallel upload thread borrows another
+                size=max(settings.IRIDA_API_POOL_SIZE, settings.IRIDA_UPLOAD_WORKERS + 1),
+                refresh_after=settings.IRIDA_TOKEN_REFRESH_SECONDS,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextmanager
+def library_client(api):
+    """Make ``iridauploader.core`` reuse ``api`` instead of authenticating again.
+
+    ``core.upload`` always calls ``api_handler.initialize_api_from_config()``,
+    which builds a brand new ``ApiCalls``; point it at the pooled client instead.
+    """
+    original_instance = api_handler._api_instance
+    original_initialize = api_handler.initialize_api_from_config
+    api_handler._api_instance = api
+    api_handler.initialize_api_from_config = api_handler._get_api_instance
+    try:
+        yield api
+    finally:
+        api_handler.initialize_api_from_config = original_initialize
+        api_handler._api_instance = original_instance
@@ -0,0 +1,48 @@
+import os
+
+LOG_FILE_NAME = 'irida-uploader.log'
+MAX_PAGE_BYTES = 64 * 1024
+
+
+def read_page(path, offset=None, max_bytes=MAX_PAGE_BYTES):
+    """Read complete lines from ``path`` starting at byte ``offset``.
+
+    Returns ``(lines, next_offset, reset, more)``. Only whole lines are returned, so
+    ``next_offset`` always points at the start of a line; a single line longer
+    than ``max_bytes`` is returned in pieces, but the unterminated last line of
+    the file is held back until it is complete. Without an ``offset`` the last
+    ``max_bytes`` of the file are returned. ``reset`` is True when the file is now
+    shorter than ``offset``, i.e. it was truncated or replaced, and reading
+    restarted from the beginning. ``more`` is True when the page was cut short
+    and further complete lines may follow.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        reset = False
+        tail = offset is None
+        if tail:
+            offset = max(0, size - max_bytes)
+        elif offset > size:
+            offset = 0
+            reset = True
+
+        f.seek(offset)
+        data = f.read(max_bytes)
+        full = len(data) == max_bytes
+
+        if tail and offset > 0:
+            # Drop the partial line the tail window starts in; without a newline the window never leaves it
+            start = data.find(b'\n') + 1
+            offset += start
+            data = data[start:] if start else b''
+
+    end = data.rfind(b'\n') + 1
+    if end == 0 and len(data) == max_bytes and offset + len(data) < size:
+        # A line longer than a page; the unterminated last line of the file is still being written
+        end = len(data)
+    chunk = data[:end]
+    lines = [
+        line.strip() for line in chunk.decode('utf-8', errors='replace').splitlines()
+        if line.strip()
+    ]
+    return lines, offset + end, reset, full and 0 < end and offset + end < size
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+from uploader import scanner
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks SampleList.csv generation on a synthetic run folder tree'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--files',
+            type=int,
+            default=100000,
+            help='Number of files to create in the synthetic tree'
+        )
+        parser.add_argument(
+            '--path',
+            default=None,
+            help='Directory to build the tree in (defaults to a temporary directory)'
+        )
+
+    def _build_tree(self, root, num_files):
+        """Paired fastqs spread over nested lane folders, plus non-fastq noise."""
+        created = 0
+        folder = 0
+        while created < num_files:
+            lane = os.path.join(root, f"Lane_{folder // 10}", f"Tile_{folder}") if folder else root
+            os.makedirs(lane, exist_ok=True)
+            for i in range(100):
+                if created >= num_files:
+                    break
+                sample = f"Sample{folder}x{i}_S{i % 999 + 1}"
+                for name in (f"{sample}_R1_001.fastq.gz", f"{sample}_R2_001.fastq.gz", f"{sample}.json"):
+                    open(os.path.join(lane, name), 'wb').close()
+                created += 3
+            folder += 1
+
+    def _rglob_scan(self, root):
+        """The three rglob passes the previous prepare_sample_list made."""
+        p = pathlib.Path(root)
+        r1_files = list(p.rglob("*_R1*.fastq.gz"))
+        list(p.rglob("*.fastq.gz"))
+        fastqs = list(p.rglob("*_R1*.fastq.gz"))
+        return len(r1_files), len(fastqs)
+
+    def handle(self, *args, **options):
+        root = options['path'] or tempfile.mkdtemp(prefix='iuw-bench-')
+        try:
+            self.stdout.write(f"Building {options['files']} files in {root}")
+            self._build_tree(root, options['files'])
+
+            start = time.perf_counter()
+            self._rglob_scan(root)
+            rglob_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            scanner.write_sample_list(root, project_id=1)
+            scandir_time = time.perf_counter() - start
+
+            self.stdout.write(f"rglob x3:        {rglob_time:.2f}s")
+            self.stdout.write(f"single scandir:  {scandir_time:.2f}s (including writing SampleList.csv)")
+            self.stdout.write(self.style.SUCCESS(f"Speed-up: {rglob_time / scandir_time:.1f}x"))
+        finally:
+            if not options['path']:
+                shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from uploader.models import Upload
+from uploader.tasks import compute_checksums
+
+
+class Command(BaseCommand):
+    help = 'Records MD5 and SHA-256 checksums of the fastq files of already uploaded folders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'upload_ids',
+            nargs='*',
+            type=int,
+            help='Uploads to checksum'
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Checksum every successful upload that has no checksums yet'
+        )
+        parser.add_argument(
+            '--queue',
+            action='store_true',
+            help='Queue Celery tasks instead of hashing in this process'
+        )
+
+    def handle(self, *args, **options):
+        upload_ids = list(options['upload_ids'])
+        if options['missing']:
+            upload_ids += list(
+                Upload.objects.filter(status='success', checksums={}).values_list('id', flat=True)
+            )
+        if not upload_ids:
+            raise CommandError('Give upload ids or --missing')
+
+        for upload_id in upload_ids:
+            if options['queue']:
+                compute_checksums.delay(upload_id)
+                self.stdout.write(f"Queued upload {upload_id}")
+                continue
+            try:
+                files = compute_checksums(upload_id)
+            except Exception as e:
+                self.stderr.write(f"Upload {upload_id}: {str(e)}")
+                continue
+            self.stdout.write(f"Upload {upload_id}: checksums of {files} files recorded")
@@ -0,0 +1,201 @@
+from django.core.management.base import BaseCommand
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import itertools
+import json
+import re
+import socket
+import threading
+
+
+class MockIrida:
+    """In-memory stand-in for the parts of the IRIDA REST API used by the uploader."""
+
+    def __init__(self, fail_after=None, fail_times=0):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.projects = {}
+        self.samples = {}
+        self.runs = {}
+        self.files = []
+        self.fail_after = fail_after
+        self.fail_times = fail_times
+
+    def new_id(self):
+        with self.lock:
+            return next(self.ids)
+
+
+class MockIridaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Like a real server, give up on clients that stop sending mid-request
+    timeout = 5
+    irida = None
+
+    def log_message(self, format, *args):
+        self.server.command.stdout.write(f"{self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+    def _send(self, status, payload=None, raw=None):
+        body = raw if raw is not None else json.dumps(payload or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        # ApiCalls builds some URLs with a doubled slash, e.g. "api//version"
+        return re.sub('/+', '/', urlparse(self.path).path).rstrip('/')
+
+    def _json_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _receive_files(self):
+        """Read a sequence file upload, dropping the connection mid-body when asked to."""
+        length = int(self.headers.get('Content-Length', 0))
+        received = 0
+        irida = self.irida
+        while received < length:
+            chunk = self.rfile.read(min(1024 * 1024, length - received))
+            if not chunk:
+                break
+            received += len(chunk)
+            if irida.fail_after is not None and received >= irida.fail_after:
+                with irida.lock:
+                    should_fail = irida.fail_times > 0
+                    if should_fail:
+                        irida.fail_times -= 1
+                if not should_fail:
+                    continue
+                self.server.command.stdout.write(f"Dropping connection after {received} bytes")
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return None
+        return received
+
+    def do_OPTIONS(self):
+        self._send(200)
+
+    def do_GET(self):
+        irida = self.irida
+        path = self._path()
+        if path == '/api/version':
+            return self._send(200, {'version': '23.01'})
+        if path == '/api/projects':
+            return self._send(200, {'resource': {'resources': list(irida.projects.values())}})
+        if path == '/api/sequencingrun':
+            return self._send(200, {'resource': {'resources': list(irida.runs.values())}})
+        m = re.fullmatch(r'/api/projects/(\d+)', path)
+        if m:
+            project = irida.projects.get(m.group(1))
+            return self._send(200, {'resource': project}) if project else self._send(404)
+        m = re.fullmatch(r'/api/projects/(\d+)/samples', path)
+        if m:
+            samples = [s for s in irida.samples.values() if s['project'] == m.group(1)]
+            return self._send(200, {'resource': {'resources': [self._sample(s) for s in samples]}})
+        m = re.fullmatch(r'/api/projects/(\d+)/samples/bySampleName', path)
+        if m:
+            name = parse_qs(urlparse(self.path).query).get('sampleName', [''])[0]
+            for sample in irida.samples.values():
+                if sample['project'] == m.group(1) and sample['sampleName'] == name:
+                    return self._send(200, {'resource': self._sample(sample)})
+            return self._send(404)
+        m = re.fullmatch(r'/api/samples/(\d+)', path)
+        if m:
+            sample = irida.samples.get(m.group(1))
+            return self._send(200, {'resource': self._sample(sample)}) if sample else self._send(404)
+        m = re.fullmatch(r'/api/samples/(\d+)/sequenceFiles', path)
+        if m:
+            files = [f for f in irida.files if f['sample'] == m.group(1)]
+            return self._send(200, {'resource': {'resources': files}})
+        self._send(404)
+
+    def do_POST(self):
+        irida = self.irida
+        path = self._path()
+        if path == '/api/oauth/token':
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            token = {'access_token': 'mock-token', 'token_type': 'bearer', 'expires_in': 43200}
+            return self._send(200, raw=repr(token).encode())
+        if path == '/api/projects':
+            data = self._json_body()
+            identifier = str(irida.new_id())
+            irida.projects[identifier] = {'identifier': identifier, 'name': data['name'],
+                                          'projectDescription': data.get('projectDescription', '')}
+            return self._send(201, {'resource': irida.projects[identifier]})
+        m = re.fullmatch(r'/api/projects/(\d+)/samples', path)
+        if m:
+            data = self._json_body()
+            identifier = str(irida.new_id())
+            irida.samples[identifier] = {'identifier': identifier, 'project': m.group(1),
+                                         'sampleName': data['sampleName'],
+                                         'description': data.get('description', '')}
+            return self._send(201, {'resource': self._sample(irida.samples[identifier])})
+        m = re.fullmatch(r'/api/samples/(\d+)/(pairs|sequenceFiles)', path)
+        if m:
+            received = self._receive_files()
+            if received is None:
+                return
+            identifier = str(irida.new_id())
+            with irida.lock:
+                irida.files.append({'identifier': identifier, 'sample': m.group(1), 'bytes': received})
+            return self._send(201, {'resource': {'identifier': identifier}})
+        m = re.fullmatch(r'/api/sequencingrun/([^/]+)', path)
+        if m:
+            self._json_body()
+            identifier = str(irida.new_id())
+            irida.runs[identifier] = {'identifier': identifier, 'uploadStatus': 'UPLOADING'}
+            return self._send(201, {'resource': irida.runs[identifier]})
+        self._send(404)
+
+    def do_PATCH(self):
+        m = re.fullmatch(r'/api/sequencingrun/(\d+)', self._path())
+        if m and m.group(1) in self.irida.runs:
+            self.irida.runs[m.group(1)].update(self._json_body())
+            return self._send(200, {'resource': self.irida.runs[m.group(1)]})
+        self._send(404)
+
+    @staticmethod
+    def _sample(sample):
+        return {k: v for k, v in sample.items() if k != 'project'}
+
+
+class Command(BaseCommand):
+    help = 'Runs an in-memory IRIDA API stand-in for exercising uploads locally'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8081,
+            help='Port to listen on; point IRIDA_API_URL at http://127.0.0.1:<port>/api/'
+        )
+        parser.add_argument(
+            '--fail-after',
+            type=int,
+            default=None,
+            help='Drop sequence file uploads after receiving this many bytes'
+        )
+        parser.add_argument(
+            '--fail-times',
+            type=int,
+            default=1,
+            help='Number of uploads to drop when --fail-after is set'
+        )
+
+    def handle(self, *args, **options):
+        handler = type('Handler', (MockIridaHandler,), {
+            'irida': MockIrida(options['fail_after'], options['fail_times']),
+        })
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), handler)
+        server.command = self
+        self.stdout.write(
+            self.style.SUCCESS(f"Mock IRIDA listening on http://127.0.0.1:{options['port']}/api/")
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from uploader.run_watcher import RunWatcher
+
+
+class Command(BaseCommand):
+    help = 'Watches UPLOAD_ROOT for run folders that finished copying and readies or queues their upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--auto-upload',
+            action='store_true',
+            default=settings.RUN_WATCH_AUTO_UPLOAD,
+            help='Queue complete run folders for upload instead of only notifying their owner'
+        )
+        parser.add_argument(
+            '--poll',
+            action='store_true',
+            help='Poll only, even where inotify is available'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Check every run folder once and exit'
+        )
+
+    def handle(self, *args, **options):
+        watcher = RunWatcher(
+            settings.UPLOAD_ROOT,
+            quiescence=settings.RUN_QUIESCENCE_SECONDS,
+            poll_seconds=settings.RUN_WATCH_POLL_SECONDS,
+            markers=settings.RUN_COMPLETE_MARKERS,
+            auto_upload=options['auto_upload'],
+            use_inotify=not (options['poll'] or options['once']),
+        )
+        if options['once']:
+            watcher.poll()
+            return
+        watcher.run_forever()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from . import scanner
+from .scanner import FASTQ_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = '.iuw_manifest.json'
+MANIFEST_VERSION = 1
+# Folder mtimes are only trusted once they are older than this, so files added
+# within the timestamp granularity of the filesystem are not missed
+MTIME_SETTLE_NS = 2 * 1000 ** 3
+
+
+def _list_folder(path):
+    """List one folder: its mtime, the size and mtime of each fastq, and its subfolders."""
+    # Take the mtime before listing so a change made during the listing is seen next time
+    mtime = os.stat(path).st_mtime_ns
+    files = {}
+    subfolders = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.path)
+            elif entry.name.endswith(FASTQ_SUFFIX):
+                st = entry.stat()
+                files[entry.name] = [st.st_size, st.st_mtime_ns]
+    return {'mtime': mtime, 'listed_at': time.time_ns(), 'files': files, 'subfolders': subfolders}
+
+
+def _restat(path, listing):
+    """Refresh file stats of an unchanged folder; None if one of its files disappeared."""
+    files = {}
+    for name in listing['files']:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            return None
+        files[name] = [st.st_size, st.st_mtime_ns]
+    return dict(listing, files=files)
+
+
+class Manifest:
+    """Fingerprint of the fastq files a generated ``SampleList.csv`` was built from.
+
+    Stored next to ``SampleList.csv`` as ``.iuw_manifest.json``. It keeps every
+    folder's listing with the folder mtime, so on the next submission only folders
+    whose mtime changed are listed again; files in untouched folders just get a
+    stat. The fingerprint hashes each fastq path with its size and mtime.
+    """
+
+    def __init__(self, directory, data=None):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, MANIFEST_FILE_NAME)
+        self.data = data or {}
+        self.relisted = 0
+
+    @classmethod
+    def load(cls, directory):
+        path = os.path.join(directory, MANIFEST_FILE_NAME)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(directory)
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+            return cls(directory)
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return cls(directory)
+        return cls(directory, data)
+
+    @property
+    def project_id(self):
+        return self.data.get('project_id')
+
+    def owns(self, sample_file):
+        """True if ``sample_file`` is the sheet this manifest wrote and it was not edited since."""
+        try:
+            st = os.stat(sample_file)
+        except FileNotFoundError:
+            return False
+        return self.data.get('sample_list') == [st.st_size, st.st_mtime_ns]
+
+    def refresh(self):
+        """Bring the folder listings up to date and return the current fingerprint."""
+        cached = self.data.get('folders', {})
+        folders = {}
+        self.relisted = 0
+        stack = [self.directory]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            listing = cached.get(path)
+            if listing and listing['mtime'] == mtime and listing['listed_at'] - mtime > MTIME_SETTLE_NS:
+                listing = _restat(path, listing)
+            else:
+                listing = None
+            if listing is None:
+                try:
+                    listing = _list_folder(path)
+                except PermissionError as e:
+                    logger.warning(f"Skipping unreadable directory {path}: {str(e)}")
+                    continue
+                self.relisted += 1
+            folders[path] = listing
+            stack.extend(listing['subfolders'])
+        self.data['folders'] = folders
+        return self.fingerprint()
+
+    def fastq_paths(self):
+        return [
+            os.path.join(folder, name)
+            for folder, listing in self.data.get('folders', {}).items()
+            for name in listing['files']
+        ]
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for folder, listing in sorted(self.data.get('folders', {}).items()):
+            for name, (size, mtime) in sorted(listing['files'].items()):
+                digest.update(f"{os.path.join(folder, name)}\0{size}\0{mtime}\n".encode())
+        return digest.hexdigest()
+
+    def folder_fingerprint(self):
+        """``scanner.fastq_fingerprint`` of the folder as last refreshed, without walking it again."""
+        return scanner.fingerprint(
+            (os.path.relpath(os.path.join(folder, name), self.directory), size, mtime)
+            for folder, listing in self.data.get('folders', {}).items()
+            for name, (size, mtime) in listing['files'].items()
+        )
+
+    def matches(self, sample_file, project_id, options):
+        """True if ``sample_file`` is still valid for the folder as it was last refreshed."""
+        return (self.owns(sample_file)
+                and self.data.get('project_id') == project_id
+                and self.data.get('options') == options
+                and self.data.get('fingerprint') == self.fingerprint())
+
+    def save(self, sample_file, project_id, options):
+        st = os.stat(sample_file)
+        self.data.update({
+            'version': MANIFEST_VERSION,
+            'project_id': project_id,
+            'options': options,
+            'fingerprint': self.fingerprint(),
+            'sample_list': [st.st_size, st.st_mtime_ns],
+        })
+        self._write()
+
+    def save_listing(self):
+        """Persist the folder listings alone, so the sample list built later only restats the files."""
+        self.data['version'] = MANIFEST_VERSION
+        self._write()
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
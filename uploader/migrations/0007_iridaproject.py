@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 00:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0006_upload_retry_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IridaProject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('project_id', models.CharField(max_length=50)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0007_iridaproject'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='queue',
+            field=models.CharField(choices=[('express', 'Express'), ('bulk', 'Bulk')], default='bulk', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='total_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0008_upload_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='bytes_transferred',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='worker_host',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
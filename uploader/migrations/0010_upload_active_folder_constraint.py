@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:04
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_uploads(apps, schema_editor):
+    """Keep only the newest active upload of each folder so the constraint can be added."""
+    Upload = apps.get_model('uploader', 'Upload')
+    seen = set()
+    for upload in Upload.objects.filter(status__in=['submitted', 'uploading']).order_by('-created_at', '-id'):
+        key = (upload.user_id, upload.folder_name)
+        if key in seen:
+            Upload.objects.filter(id=upload.id).update(status='failed')
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0009_upload_throughput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_active_uploads, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='upload',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['submitted', 'uploading'])), fields=('user', 'folder_name'), name='unique_active_upload_per_folder'),
+        ),
+    ]
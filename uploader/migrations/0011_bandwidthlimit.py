@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0010_upload_active_folder_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BandwidthLimit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bytes_per_second', models.PositiveBigIntegerField(help_text='0 means unlimited')),
+                ('user', models.OneToOneField(blank=True, help_text='Leave empty for the limit of all uploads together', null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
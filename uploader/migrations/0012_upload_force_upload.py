@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0011_bandwidthlimit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='force_upload',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0012_upload_force_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='checksums',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0013_upload_checksums'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.CharField(max_length=50)),
+                ('path', models.CharField(max_length=1024)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('sample_name', models.CharField(max_length=255)),
+                ('sample_id', models.CharField(max_length=50)),
+                ('sequencing_object_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('run_id', models.CharField(max_length=50)),
+                ('uploaded_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='uploadedfile',
+            constraint=models.UniqueConstraint(fields=('project_id', 'path'), name='unique_uploaded_file_per_project'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploader', '0014_uploadedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='resend_all',
+            field=models.BooleanField(default=False),
+        ),
+    ]
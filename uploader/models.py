@@ -1,11 +1,16 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.utils import timezone
 import os
-import json
 import logging
 
+from . import bandwidth, events, status_file
+
 logger = logging.getLogger(__name__)
 
 class User(AbstractUser):
@@ -27,6 +32,11 @@ class Upload(models.Model):
         ('failed', 'Failed'),
         ('success', 'Success')
     ]
+    QUEUE_CHOICES = [
+        ('express', 'Express'),
+        ('bulk', 'Bulk')
+    ]
+    ACTIVE_STATUSES = ('submitted', 'uploading')
     
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     folder_name = models.CharField(max_length=255)
@@ -40,39 +50,66 @@ class Upload(models.Model):
     irida_run_id = models.CharField(max_length=50, null=True, blank=True)  # New field for Run ID
     uploaded_samples = models.JSONField(default=list, blank=True)  # New field to store sample details
     retry_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(null=True, blank=True)  # Size of the folder's fastq files at submission
+    queue = models.CharField(max_length=20, choices=QUEUE_CHOICES, default='bulk')
+    started_at = models.DateTimeField(null=True, blank=True)  # When the transfer got an upload slot
+    finished_at = models.DateTimeField(null=True, blank=True)
+    bytes_transferred = models.BigIntegerField(null=True, blank=True)  # Bytes sent by the last transfer
+    worker_host = models.CharField(max_length=255, null=True, blank=True)
+    fingerprint = models.CharField(max_length=64, null=True, blank=True)  # Of the folder's fastq files at submission
+    force_upload = models.BooleanField(default=False)  # Kept so a resumed upload runs with the same options
+    resend_all = models.BooleanField(default=False)  # A forced upload also resends files IRIDA already has
+    checksums = models.JSONField(default=dict, blank=True)  # {path in folder: {size, md5, sha256}} of sent files
+
+    # Shown by open dashboards, see events.upload_snapshot
+    DASHBOARD_FIELDS = ('status', 'sample_count', 'irida_project_id', 'irida_run_id')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_status = self.__dict__.get('status')
+        self._published = self._dashboard_state()
+
+    def _dashboard_state(self):
+        # Read from __dict__ so deferred fields are not loaded
+        return tuple(self.__dict__.get(field) for field in self.DASHBOARD_FIELDS)
+
+    def save(self, *args, **kwargs):
+        queue_changed = self._state.adding or self.status != self._saved_status
+        super().save(*args, **kwargs)
+        # Let open dashboards know without them polling, if anything they show changed
+        state = self._dashboard_state()
+        if queue_changed or state != self._published:
+            events.publish_upload(self, queue_changed=queue_changed)
+            self._published = state
+        if queue_changed:
+            from .tasks import queue_changed as on_queue_changed  # tasks imports this module
+            transaction.on_commit(on_queue_changed)
+        self._saved_status = self.status
+
     def update_from_status_file(self):
         """Updates the upload record with information from the status file"""
-        status_file = os.path.join(self.get_full_path(), 'irida_uploader_status.info')
-        if os.path.exists(status_file):
-            try:
-                with open(status_file, 'r') as f:
-                    data = json.loads(f.read())
-                    
-                    # Update Run ID
-                    self.irida_run_id = data.get('Run ID')
-                    
-                    # Update sample information
-                    sample_status = data.get('Sample Status', [])
-                    successful_samples = [
-                        {
-                            'name': s['Sample Name'],
-                            'project_id': s['Project ID']  # Store Project ID from status file
-                        }
-                        for s in sample_status
-                        if s.get('Uploaded') == 'True'
-                    ]
-                    
-                    self.uploaded_samples = successful_samples
-                    self.sample_count = len(successful_samples)
-                    
-                    # Update project ID if not already set
-                    if not self.irida_project_id and successful_samples:
-                        self.irida_project_id = successful_samples[0]['project_id']
-                    
-                    self.save()
-                    return True
-            except Exception as e:
-                logger.error(f"Error updating from status file: {str(e)}")
+        try:
+            run_status = status_file.read(self.get_full_path())
+            if run_status is None:
+                return False
+
+            # Update Run ID
+            self.irida_run_id = run_status.run_id
+
+            # Update sample information
+            successful_samples = run_status.uploaded_samples
+
+            self.uploaded_samples = successful_samples
+            self.sample_count = len(successful_samples)
+
+            # Update project ID if not already set
+            if not self.irida_project_id and successful_samples:
+                self.irida_project_id = successful_samples[0]['project_id']
+
+            self.save()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating from status file: {str(e)}")
         return False
 
     def get_file_info(self):
@@ -88,6 +125,14 @@ class Upload(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # Two tasks uploading one folder would both write its irida_uploader_status.info
+            models.UniqueConstraint(
+                fields=['user', 'folder_name'],
+                condition=models.Q(status__in=['submitted', 'uploading']),
+                name='unique_active_upload_per_folder'
+            )
+        ]
 
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
@@ -103,3 +148,58 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
     related_upload = models.ForeignKey(Upload, on_delete=models.CASCADE, null=True, blank=True)
+
+class IridaProject(models.Model):
+    """Local index of IRIDA projects keyed by name, refreshed from the IRIDA API"""
+    name = models.CharField(max_length=255, unique=True)
+    project_id = models.CharField(max_length=50)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.project_id})"
+
+class UploadedFile(models.Model):
+    """Sequence file already sent to an IRIDA project, so a forced re-upload can skip it while unchanged"""
+    project_id = models.CharField(max_length=50)
+    path = models.CharField(max_length=1024)  # Absolute path of the file when it was sent
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    sample_name = models.CharField(max_length=255)
+    sample_id = models.CharField(max_length=50)
+    sequencing_object_id = models.CharField(max_length=50, null=True, blank=True)
+    run_id = models.CharField(max_length=50)
+    uploaded_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{os.path.basename(self.path)} ({self.project_id}/{self.sample_name})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project_id', 'path'], name='unique_uploaded_file_per_project')
+        ]
+
+class BandwidthLimit(models.Model):
+    """Upload bandwidth limit shared by all workers, applied without a restart.
+
+    The row without a user limits all uploads together; a row with a user
+    limits that user's uploads. Missing rows fall back to UPLOAD_BANDWIDTH_LIMIT
+    and UPLOAD_USER_BANDWIDTH_LIMIT. 0 means unlimited.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True,
+                                help_text='Leave empty for the limit of all uploads together')
+    bytes_per_second = models.PositiveBigIntegerField(help_text='0 means unlimited')
+
+    def clean(self):
+        others = BandwidthLimit.objects.filter(user__isnull=True).exclude(pk=self.pk)
+        if self.user_id is None and others.exists():
+            raise ValidationError('There already is a limit for all uploads together')
+
+    def __str__(self):
+        scope = self.user.email if self.user else 'All uploads'
+        return f"{scope}: {self.bytes_per_second} B/s"
+
+@receiver([post_save, post_delete], sender=BandwidthLimit)
+def bandwidth_limits_changed(sender, **kwargs):
+    # Also runs for bulk deletes from the admin and for users being deleted
+    transaction.on_commit(bandwidth.sync_limits)
@@ -0,0 +1,294 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import iridauploader.api as irida_api_calls
+import iridauploader.model as irida_model
+import iridauploader.progress as progress
+from iridauploader.core import api_handler
+
+from django.conf import settings
+
+from . import checkpoints, file_index, irida_api, retries
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RETRIES = settings.IRIDA_SAMPLE_RETRIES
+SAMPLE_RETRY_BASE_SECONDS = 5
+SAMPLE_RETRY_CAP_SECONDS = 300
+# Sequence file links name the sequencing object holding the file, e.g. .../samples/5/pairs/12/files/34
+SEQUENCING_OBJECT_LINK = re.compile(r'/(?:pairs|unpaired|fast5)/(\d+)/')
+
+
+class SamplesFailedError(Exception):
+    """Some samples of a run could not be uploaded; the others were sent.
+
+    iridauploader only marks a run ERROR for the API and file errors it knows, so
+    this leaves the status file PARTIAL with the sent samples marked uploaded, and
+    continuing the upload sends only the samples that failed.
+    """
+
+    def __init__(self, errors, total):
+        self.errors = errors
+        super().__init__(f"{len(errors)} of {total} samples could not be uploaded, first error: {errors[0]}")
+
+
+def upload_sequencing_run(sequencing_run, directory_status, upload_mode, run_id=None, workers=4,
+                          on_progress=None, on_sent=None, throttle=None, heartbeat=None,
+                          sample_retries=SAMPLE_RETRIES, reuse_unchanged=False):
+    """Drop-in replacement for ``api_handler.upload_sequencing_run`` that sends samples concurrently.
+
+    Each sample is sent by one of ``workers`` threads using its own pooled API client.
+    The status file is rewritten under a lock after every sample, exactly as the
+    sequential uploader does, so partial uploads can still be continued. Transfers
+    are checkpointed per file so samples IRIDA already acknowledged are not resent.
+    ``on_progress`` is called with ``(uploaded, total)`` after each sample and
+    ``on_sent`` with the number of bytes of each sample actually sent.
+    File reads of all samples are paced by ``throttle`` if given. Reads, finished
+    samples and retry waits are reported to ``heartbeat`` if given.
+
+    A sample that fails is retried up to ``sample_retries`` times with decorrelated
+    jitter while the other samples carry on. Samples failing with an error a
+    retry cannot fix are skipped; once the rest are done the run ends PARTIAL
+    with SamplesFailedError, so continuing it sends only those. If a
+    sample still fails with a connection error after its retries, the run is
+    stopped, as the remaining samples would fail the same way.
+
+    Every file IRIDA acknowledges is recorded in the file index of its project.
+    With ``reuse_unchanged`` samples whose files are all indexed for the same
+    sample, unchanged since and still on that sample in IRIDA are not sent
+    again; the files already in IRIDA are kept. This makes a forced re-upload
+    of a corrected run send only the files that changed.
+    """
+    api_instance = api_handler._get_api_instance()
+
+    if run_id is None:
+        run_id = api_instance.create_seq_run(sequencing_run.metadata, sequencing_run.sequencing_run_type)
+        logger.info(f"Sequencing run id '{run_id}' has been created for this upload.")
+    else:
+        logger.info(f"Using existing run id '{run_id}' for this upload.")
+    directory_status.run_id = run_id
+    directory_status.status = irida_model.DirectoryStatus.PARTIAL
+    progress.write_directory_status(directory_status)
+
+    status_lock = threading.Lock()
+    pool = irida_api.get_pool()
+    store = checkpoints.CheckpointStore(directory_status.directory)
+
+    def mark_uploaded(sample_name, project_id):
+        with status_lock:
+            directory_status.set_sample_uploaded(sample_name=sample_name, project_id=project_id, uploaded=True)
+            progress.write_directory_status(directory_status)
+            if heartbeat:
+                heartbeat.beat()
+            if on_progress:
+                samples = directory_status.get_sample_status_list()
+                on_progress(sum(1 for s in samples if s.uploaded), len(samples))
+
+    def send_once(sample, project_id, files):
+        with pool.client() as client, store.transfer(files, run_id, throttle, heartbeat) as opener:
+            client.open_sequence_file = opener
+            try:
+                response = client.send_sequence_files(sequence_file=sample.sequence_file,
+                                                      sample_name=sample.sample_name,
+                                                      project_id=project_id,
+                                                      upload_id=run_id,
+                                                      upload_mode=upload_mode)
+            finally:
+                client.open_sequence_file = None
+            # The sample lookup is cached by the client from sending
+            sample_id = client.get_sample_id(sample.sample_name, project_id)
+        object_id = (response or {}).get('resource', {}).get('identifier')
+        return sample_id, object_id
+
+    indexed = []
+
+    def index_sent(sample, project_id, files, sample_id, object_id):
+        entries = [store.get(path) for path in files]
+        if not sample_id or not all(entry and entry.get('sha256') for entry in entries):
+            return
+        with status_lock:
+            indexed.append((project_id, [
+                {'path': path, 'size': entry['size'], 'mtime_ns': entry['mtime'], 'sha256': entry['sha256'],
+                 'sample_name': sample.sample_name, 'sample_id': str(sample_id),
+                 'sequencing_object_id': None if object_id is None else str(object_id), 'run_id': str(run_id)}
+                for path, entry in zip(files, entries)
+            ]))
+
+    stop = threading.Event()
+    reusable = set()
+
+    def send(sample, project_id):
+        files = sample.sequence_file.file_list
+        if (sample.sample_name, project_id) in reusable:
+            logger.info(f"Sample {sample.sample_name} on Project {project_id} is unchanged since it was sent, skipping")
+            mark_uploaded(sample.sample_name, project_id)
+            return
+        if all(store.is_confirmed(path, run_id) for path in files):
+            # IRIDA acknowledged these files but the task died before the status file was written
+            logger.info(f"Sample {sample.sample_name} on Project {project_id} was already acknowledged, skipping")
+            mark_uploaded(sample.sample_name, project_id)
+            return
+
+        logger.info(f"Uploading to Sample {sample.sample_name} on Project {project_id}")
+        delay = SAMPLE_RETRY_BASE_SECONDS
+        for attempt in range(sample_retries + 1):
+            try:
+                sample_id, object_id = send_once(sample, project_id, files)
+                break
+            except Exception as e:
+                if attempt == sample_retries or not retries.is_retryable(e):
+                    raise
+                delay = retries.decorrelated_jitter(delay, SAMPLE_RETRY_BASE_SECONDS,
+                                                           SAMPLE_RETRY_CAP_SECONDS)
+                logger.warning(f"Sample {sample.sample_name} failed: {str(e)}; "
+                               f"retry {attempt + 1} of {sample_retries} in {delay:.0f}s")
+                stopped = heartbeat.wait(stop, delay) if heartbeat else stop.wait(delay)
+                if stopped:
+                    raise
+        store.confirm(files)
+        index_sent(sample, project_id, files, sample_id, object_id)
+        if on_sent:
+            on_sent(sum(os.path.getsize(path) for path in files))
+        mark_uploaded(sample.sample_name, project_id)
+
+    try:
+        api_instance.set_seq_run_uploading(run_id)
+
+        pending = []
+        for project in sequencing_run.project_list:
+            for sample in project.sample_list:
+                if sample.skip:
+                    logger.info(f"Skipping Sample {sample.sample_name} on Project {project.id}, already uploaded.")
+                    mark_uploaded(sample.sample_name, project.id)
+                else:
+                    pending.append((sample, project.id))
+
+        if reuse_unchanged:
+            reusable.update(_unchanged_samples(api_instance, directory_status.directory, pending, workers))
+            if heartbeat:
+                heartbeat.beat()
+            logger.info(f"{len(reusable)} of {len(pending)} samples are unchanged since they were sent")
+
+        logger.info(f"Uploading {len(pending) - len(reusable)} samples with {workers} parallel workers")
+        failed = []
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='irida-upload') as executor:
+                futures = {executor.submit(send, sample, project_id): sample for sample, project_id in pending}
+                try:
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            if retries.is_retryable(e):
+                                # Still failing after its retries: IRIDA or the network is down, not this sample
+                                raise
+                            # Only this sample is at fault; the others carry on
+                            logger.error(f"Sample {futures[future].sample_name} cannot be uploaded: {str(e)}")
+                            failed.append(e)
+                except BaseException:
+                    # Stop queued samples and pending retries; samples already sending are left to finish
+                    stop.set()
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            # Written from this thread once the senders are done, so they need no database connections
+            _index(indexed)
+
+        if failed:
+            logger.error(f"{len(failed)} of {len(pending)} samples could not be uploaded; "
+                         f"continuing the upload will retry only those")
+            api_instance.set_seq_run_error(run_id)
+            raise SamplesFailedError(failed, len(pending))
+
+        api_instance.set_seq_run_complete(run_id)
+
+    except irida_api_calls.exceptions.IridaConnectionError as e:
+        logger.error("Failed to upload SequencingRun, Could not connect to IRIDA")
+        api_instance.set_seq_run_error(run_id)
+        raise e
+    except irida_api_calls.exceptions.IridaResourceError as e:
+        logger.error("Failed to upload SequencingRun, Could not access resources on IRIDA")
+        api_instance.set_seq_run_error(run_id)
+        raise e
+    except irida_api_calls.exceptions.FileError as e:
+        logger.error("Failed to upload SequencingRun, Could not access files to upload to IRIDA")
+        api_instance.set_seq_run_error(run_id)
+        raise e
+
+
+def _unchanged_samples(api_instance, directory, pending, workers):
+    """(sample name, project id) of pending samples whose files IRIDA already has, unchanged."""
+    by_project = {}
+    for sample, project_id in pending:
+        by_project.setdefault(project_id, []).append(sample)
+
+    result = set()
+    for project_id, samples in by_project.items():
+        paths = [path for sample in samples for path in sample.sequence_file.file_list]
+        entries = file_index.unchanged(project_id, directory, paths, workers=workers)
+        if not entries:
+            continue
+        # Samples deleted in IRIDA since must be sent again
+        sample_ids = {str(s.sample_id) for s in api_instance.get_samples(project_id)}
+        for sample in samples:
+            files = [entries.get(path) for path in sample.sequence_file.file_list]
+            if not all(entry and entry.sample_name == sample.sample_name and entry.sample_id in sample_ids
+                       and entry.sequencing_object_id for entry in files):
+                continue
+            # So must files deleted from the sample
+            held = _sequencing_object_ids(api_instance, project_id, sample.sample_name)
+            if all(entry.sequencing_object_id in held for entry in files):
+                result.add((sample.sample_name, project_id))
+    return result
+
+
+def _sequencing_object_ids(api_instance, project_id, sample_name):
+    """Identifiers of the sequence files of a sample in IRIDA and of the sequencing objects holding them."""
+    ids = set()
+    try:
+        resources = api_instance.get_sequence_files(project_id, sample_name)
+    except irida_api_calls.exceptions.IridaResourceError as e:
+        logger.warning(f"Could not list the files of sample {sample_name} on project {project_id}: {str(e)}")
+        return ids
+    for resource in resources:
+        ids.add(str(resource.get('identifier')))
+        for link in resource.get('links', []):
+            match = SEQUENCING_OBJECT_LINK.search(link.get('href', ''))
+            if match:
+                ids.add(match.group(1))
+    return ids
+
+
+def _index(indexed):
+    by_project = {}
+    for project_id, files in indexed:
+        by_project.setdefault(project_id, []).extend(files)
+    for project_id, files in by_project.items():
+        try:
+            file_index.record(project_id, files)
+        except Exception as e:
+            logger.warning(f"Could not index {len(files)} files sent to project {project_id}: {str(e)}")
+
+
+@contextmanager
+def parallel_samples(workers, on_progress=None, on_sent=None, throttle=None, heartbeat=None,
+                     reuse_unchanged=False):
+    """Make ``core.upload`` send samples with ``workers`` threads instead of one at a time."""
+    original = api_handler.upload_sequencing_run
+
+    def _upload(sequencing_run, directory_status, upload_mode, run_id=None):
+        return upload_sequencing_run(sequencing_run, directory_status, upload_mode,
+                                     run_id=run_id, workers=max(1, workers), on_progress=on_progress,
+                                     on_sent=on_sent, throttle=throttle, heartbeat=heartbeat,
+                                     reuse_unchanged=reuse_unchanged)
+
+    api_handler.upload_sequencing_run = _upload
+    try:
+        yield
+    finally:
+        api_handler.upload_sequencing_run = original
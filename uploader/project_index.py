@@ -0,0 +1,76 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import IridaProject
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+REFRESH_LOCK_KEY = 'iuw:irida-project-index:refresh'
+REFRESH_LOCK_EXPIRE = 5 * 60  # Seconds; a full listing of IRIDA's projects takes far less
+
+
+def is_stale():
+    """True when the last full refresh is older than IRIDA_PROJECT_INDEX_TTL."""
+    oldest = IridaProject.objects.aggregate(oldest=Min('refreshed_at'))['oldest']
+    if oldest is None:
+        return True
+    return timezone.now() - oldest > datetime.timedelta(seconds=settings.IRIDA_PROJECT_INDEX_TTL)
+
+
+def lookup(name):
+    """Return the indexed project ID for ``name``, or None if unknown or the index is stale."""
+    if is_stale():
+        return None
+    return IridaProject.objects.filter(name=name).values_list('project_id', flat=True).first()
+
+
+def refresh(api):
+    """Rebuild the index from a full ``get_projects()`` listing.
+
+    Callers hold the refresh lock, see ``find``: rows not upserted by this
+    refresh are deleted, which would include those of a concurrent one.
+    """
+    now = timezone.now()
+    # IRIDA allows duplicate names; keep the first one listed, as the old linear scan did
+    projects = {}
+    for prj in api.get_projects():
+        projects.setdefault(prj.name, str(prj.id))
+
+    with transaction.atomic():
+        IridaProject.objects.bulk_create(
+            [IridaProject(name=name, project_id=project_id, refreshed_at=now)
+             for name, project_id in projects.items()],
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=['project_id', 'refreshed_at'],
+        )
+        # Anything not listed any more was deleted or renamed in IRIDA
+        IridaProject.objects.filter(refreshed_at__lt=now).delete()
+    logger.info(f"Refreshed IRIDA project index with {len(projects)} projects")
+
+
+def find(api, name):
+    """Look ``name`` up, refreshing the index from IRIDA when it is stale or misses."""
+    project_id = lookup(name)
+    if project_id is None:
+        # One refresh at a time across all workers; one that finished meanwhile may have listed the name
+        with get_redis().lock(REFRESH_LOCK_KEY, timeout=REFRESH_LOCK_EXPIRE, blocking_timeout=REFRESH_LOCK_EXPIRE):
+            project_id = lookup(name)
+            if project_id is None:
+                refresh(api)
+                project_id = IridaProject.objects.filter(name=name).values_list('project_id', flat=True).first()
+    return project_id
+
+
+def record(name, project_id):
+    """Write-through a project that was just created with ``send_project``."""
+    IridaProject.objects.update_or_create(
+        name=name,
+        defaults={'project_id': str(project_id), 'refreshed_at': timezone.now()},
+    )
@@ -0,0 +1,19 @@
+import os
+import threading
+
+import redis
+from django.conf import settings
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Return a Redis client for REDIS_URL, shared by all threads in this process."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = redis.Redis.from_url(settings.REDIS_URL)
+            _client_pid = os.getpid()
+        return _client
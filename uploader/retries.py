@@ -0,0 +1,35 @@
+import random
+
+import iridauploader.api as irida_api_calls
+import iridauploader.parsers as irida_parsers
+import iridauploader.progress as progress
+
+from .fastq_check import FastqValidationError
+
+# Errors that will fail again however often they are retried: bad requests,
+# missing permissions, projects or samples, unreadable or invalid run folders and files
+FATAL_ERRORS = (
+    irida_api_calls.exceptions.IridaResourceError,
+    irida_api_calls.exceptions.FileError,
+    irida_api_calls.exceptions.IridaUploadCanceledException,
+    irida_parsers.exceptions.ValidationError,
+    irida_parsers.exceptions.DirectoryError,
+    progress.exceptions.DirectoryError,
+    FastqValidationError,
+    FileNotFoundError,
+    PermissionError,
+)
+
+
+def is_retryable(exc):
+    """False for errors that a retry cannot fix; anything else is worth another attempt."""
+    return not isinstance(exc, FATAL_ERRORS)
+
+
+def decorrelated_jitter(previous, base, cap):
+    """Next delay after ``previous`` seconds: random between ``base`` and three times ``previous``.
+
+    Unlike plain exponential backoff the delays of clients that failed together
+    drift apart, so they do not all hit IRIDA again at the same moment.
+    """
+    return min(cap, random.uniform(base, max(base, previous) * 3))
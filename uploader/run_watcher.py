@@ -0,0 +1,368 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from django.db import IntegrityError, transaction
+
+from . import manifest, scanner, status_file, tasks
+from .models import Notification, Upload, User
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_KEY = 'iuw:completed-runs'  # Run folder path -> fastq fingerprint it was handled with
+SINCE_KEY = 'iuw:completed-runs:since'  # When the watcher first ran; runs copied before are left alone
+COMPLETED_EXPIRE = 30 * 24 * 60 * 60  # Completed runs are forgotten this long after the watcher last polled
+RECHECK_POLLS = 10  # Handled folders are listed again every this many polls, to catch changes inotify cannot see
+
+
+class Inotify:
+    """Minimal inotify(7) binding through libc; raises OSError where inotify is unavailable.
+
+    inotify only sees changes made through this host's kernel, so files written
+    to an NFS share from another host are not reported; callers still poll.
+    """
+
+    CREATE = 0x100
+    DELETE = 0x200
+    MOVED_FROM = 0x40
+    MOVED_TO = 0x80
+    CLOSE_WRITE = 0x8
+    ISDIR = 0x40000000
+    Q_OVERFLOW = 0x4000
+    IGNORED = 0x8000
+    MASK = CREATE | DELETE | MOVED_FROM | MOVED_TO | CLOSE_WRITE  # Not MODIFY, which fires on every write
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}  # Watch descriptor -> directory
+        self.watched = set()
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {path}")
+        self.paths[wd] = path
+        self.watched.add(path)
+        return wd
+
+    def read(self, timeout):
+        """Wait up to ``timeout`` seconds; returns ``(directory, name, mask)`` for each event."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, pos)
+            pos += self._EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            if mask & self.IGNORED:
+                self.watched.discard(self.paths.pop(wd, None))
+            elif wd in self.paths or mask & self.Q_OVERFLOW:
+                events.append((self.paths.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RunFolder:
+    """What the watcher knows about one run folder, ``UPLOAD_ROOT/<user>/<folder>``."""
+
+    def __init__(self, path, user_dir):
+        self.path = path
+        self.user_dir = user_dir
+        self.manifest = manifest.Manifest.load(path)
+        self.fingerprint = None
+        self.changed_at = 0  # Last change to its fastq files seen by a poll or an event
+        self.handled = False
+        self.waiting_for = None  # Fingerprint already reported as incomplete
+
+
+class RunWatcher:
+    """Finds run folders that finished copying and readies them for upload.
+
+    A run folder is complete when one of ``markers`` exists in it, or when its
+    fastq files stopped changing for ``quiescence`` seconds. Folders are
+    polled every ``poll_seconds`` through their Manifest, which only lists
+    folders again whose mtime changed, so the listing keeps pace with the copy
+    and is written out for prepare_sample_list once the run is complete. Where
+    inotify is available it reports local writes as they happen, which keeps
+    busy folders from being polled and picks up new folders at once.
+
+    A complete folder is queued for upload if ``auto_upload`` is set, otherwise
+    its owner is notified that it is ready. Folders already uploaded or queued
+    are left alone, and each folder is handled once per fingerprint, also
+    across restarts. Handled folders are listed again every ``RECHECK_POLLS``
+    polls and handled anew if their fastq files changed.
+    """
+
+    def __init__(self, root, quiescence, poll_seconds, markers, auto_upload, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.quiescence = quiescence
+        self.poll_seconds = poll_seconds
+        self.markers = markers
+        self.auto_upload = auto_upload
+        self.runs = {}
+        self.polls = 0
+        self._pruned = False
+        self.inotify = None
+        self._watch_limit_hit = False
+        get_redis().set(SINCE_KEY, time.time(), nx=True)
+        self.since = float(get_redis().get(SINCE_KEY))
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                logger.info(f"inotify unavailable, polling only: {str(e)}")
+
+    def _watch(self, path):
+        if self.inotify is None or self._watch_limit_hit or path in self.inotify.watched:
+            return
+        try:
+            self.inotify.add_watch(path)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # fs.inotify.max_user_watches reached; the remaining folders are polled
+                logger.warning("inotify watch limit reached, polling the remaining folders")
+                self._watch_limit_hit = True
+            elif e.errno != errno.ENOENT:
+                logger.warning(str(e))
+
+    def _list_dirs(self, path):
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+    def discover(self):
+        """Pick up new run folders and forget removed ones.
+
+        A user folder that cannot be listed, e.g. during an NFS hiccup, keeps
+        the run folders known from before.
+        """
+        try:
+            user_dirs = self._list_dirs(self.root)
+        except OSError as e:
+            logger.warning(f"Cannot list {self.root}: {str(e)}")
+            return
+        self._watch(self.root)
+        found = set()
+        complete = True
+        for user_dir in user_dirs:
+            try:
+                folders = self._list_dirs(user_dir)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Cannot list {user_dir}: {str(e)}")
+                found.update(path for path, run in self.runs.items() if run.user_dir == user_dir)
+                complete = False
+                continue
+            self._watch(user_dir)
+            for folder in folders:
+                found.add(folder)
+                if folder not in self.runs:
+                    self.runs[folder] = RunFolder(folder, user_dir)
+
+        removed = set(self.runs) - found
+        for path in removed:
+            del self.runs[path]
+        try:
+            if not self._pruned and complete:
+                # Once per start, drop what is recorded for folders removed while the watcher was down
+                removed.update(field.decode() for field in get_redis().hkeys(COMPLETED_KEY))
+                removed -= found
+                self._pruned = True
+            pipe = get_redis().pipeline()
+            if removed:
+                pipe.hdel(COMPLETED_KEY, *removed)
+            pipe.expire(COMPLETED_KEY, COMPLETED_EXPIRE)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Cannot prune completed runs: {str(e)}")
+
+    def _run_of(self, directory, name):
+        """The run folder an event in ``directory`` concerns, or None."""
+        parts = os.path.relpath(os.path.join(directory, name), self.root).split(os.sep)
+        if len(parts) < 2 or parts[0] == '..':
+            return None
+        return self.runs.get(os.path.join(self.root, parts[0], parts[1]))
+
+    def handle_events(self, events):
+        now = time.time()
+        for directory, name, mask in events:
+            if directory is None:
+                # The event queue overflowed; the next poll catches up
+                continue
+            if mask & Inotify.ISDIR and mask & (Inotify.CREATE | Inotify.MOVED_TO):
+                if directory == self.root or os.path.dirname(directory) == self.root:
+                    # A new user folder or run folder
+                    self.discover()
+                else:
+                    self._watch(os.path.join(directory, name))
+            run = self._run_of(directory, name)
+            if run is None:
+                continue
+            # Our own manifest and sample list writes do not count as activity
+            if mask & Inotify.ISDIR or name.endswith(scanner.FASTQ_SUFFIX) or name in self.markers:
+                run.changed_at = now
+                run.handled = False
+
+    def check(self, run, now):
+        """Refresh ``run``'s listing; True once it is complete."""
+        fingerprint = run.manifest.refresh()
+        files = [f for listing in run.manifest.data['folders'].values() for f in listing['files'].values()]
+        if not files:
+            run.fingerprint = fingerprint
+            return False
+        if run.fingerprint is None:
+            # First look at the folder: it has been quiet since its newest file was written
+            newest = max(mtime for size, mtime in files) / 1e9
+            if newest < self.since:
+                logger.debug(f"{run.path} was copied before the watcher first ran, leaving it")
+                run.fingerprint = fingerprint
+                run.handled = True
+                return False
+            run.changed_at = newest
+        elif fingerprint != run.fingerprint:
+            run.changed_at = now
+        run.fingerprint = fingerprint
+        if any(os.path.exists(os.path.join(run.path, marker)) for marker in self.markers):
+            return True
+        return now - run.changed_at >= self.quiescence
+
+    def recheck(self, run, now):
+        """Look at a handled folder again; it is checked anew if its fastq files changed since."""
+        if run.manifest.refresh() != run.fingerprint:
+            run.handled = False
+            run.changed_at = now
+
+    def poll(self):
+        self.discover()
+        now = time.time()
+        self.polls += 1
+        for run in list(self.runs.values()):
+            if run.handled:
+                if self.polls % RECHECK_POLLS == 0:
+                    try:
+                        self.recheck(run, now)
+                    except Exception as e:
+                        logger.error(f"Error checking run folder {run.path}: {str(e)}")
+                continue
+            # Folders written to right now cannot be complete; skip their listing until they settle
+            if now - run.changed_at < min(self.poll_seconds, self.quiescence):
+                continue
+            try:
+                if self.check(run, now):
+                    self.complete(run)
+            except Exception as e:
+                logger.error(f"Error checking run folder {run.path}: {str(e)}")
+            if self.inotify is not None and not run.handled:
+                for folder in run.manifest.data.get('folders', {}):
+                    self._watch(folder)
+
+    def complete(self, run):
+        """Ready or queue a complete folder; it counts as handled only once that succeeded."""
+        if get_redis().hget(COMPLETED_KEY, run.path) == run.fingerprint.encode():
+            run.handled = True
+            return
+
+        if self.process(run):
+            pipe = get_redis().pipeline()
+            pipe.hset(COMPLETED_KEY, run.path, run.fingerprint)
+            pipe.expire(COMPLETED_KEY, COMPLETED_EXPIRE)
+            pipe.execute()
+            run.handled = True
+
+    def process(self, run):
+        """Notify the owner of ``run`` or queue its upload; False if the run is not ready after all."""
+        paths = run.manifest.fastq_paths()
+        result = scanner.scan_directory(run.path, paths=paths)
+        if result.paired_end and result.orphan_forward:
+            # Most likely the R2 files are still being copied
+            if run.waiting_for != run.fingerprint:
+                logger.warning(f"{run.path} stopped changing but {len(result.orphan_forward)} R1 files "
+                               f"have no R2, waiting")
+                run.waiting_for = run.fingerprint
+            return False
+
+        run.manifest.save_listing()
+        folder_name = os.path.basename(run.path)
+        user = User.objects.filter(email__iexact=os.path.basename(run.user_dir)).first()
+        if user is None:
+            logger.info(f"{run.path} is complete but belongs to no user")
+            return True
+        if status_file.read(run.path) is not None:
+            logger.info(f"{run.path} is complete and was uploaded before, leaving it")
+            return True
+        logger.info(f"{run.path} is complete: {len(paths)} fastq files")
+
+        if not self.auto_upload:
+            Notification.objects.create(
+                user=user,
+                title='Run Ready',
+                message=f'{folder_name} has finished copying and is ready to upload.',
+                type='info'
+            )
+            return True
+
+        fingerprint, total_bytes = run.manifest.folder_fingerprint()
+        try:
+            with transaction.atomic():
+                upload = Upload.objects.create(
+                    user=user,
+                    folder_name=folder_name,
+                    status='submitted',
+                    fingerprint=fingerprint,
+                    total_bytes=total_bytes
+                )
+        except IntegrityError:
+            logger.info(f"{run.path} is complete and already queued")
+            return True
+        try:
+            tasks.enqueue_upload(upload)
+        except Exception:
+            # Not queued, so it must not block the next attempt or a manual submission
+            upload.delete()
+            raise
+        Notification.objects.create(
+            user=user,
+            title='Upload Started Automatically',
+            message=f'{folder_name} has finished copying and was queued for upload.',
+            type='info',
+            related_upload=upload
+        )
+        return True
+
+    def run_forever(self):
+        mode = 'inotify and polling' if self.inotify else 'polling'
+        logger.info(f"Watching {self.root} for complete runs with {mode}, "
+                    f"auto upload {'on' if self.auto_upload else 'off'}")
+        next_poll = 0
+        while True:
+            now = time.monotonic()
+            if now >= next_poll:
+                self.poll()
+                next_poll = now + self.poll_seconds
+            timeout = max(0, next_poll - time.monotonic())
+            if self.inotify:
+                self.handle_events(self.inotify.read(timeout))
+            else:
+                time.sleep(timeout)
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+FASTQ_SUFFIX = '.fastq.gz'
+PAIRED_REGEX = re.compile("_S[0-9]{1,3}|_R[12].|_1.non_host.fastq.gz|_2.non_host.fastq.gz")
+SINGLE_REGEX = re.compile(".fastq|.fq.")
+
+
+def iter_fastq_entries(directory):
+    """Yield an ``os.DirEntry`` for every ``*.fastq.gz`` below ``directory``.
+
+    Each folder is listed exactly once with ``os.scandir``, whose entries carry the
+    file type from the directory listing, so no extra stat calls are made.
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(FASTQ_SUFFIX):
+                        yield entry
+        except PermissionError as e:
+            logger.warning(f"Skipping unreadable directory {current}: {str(e)}")
+
+
+def fastq_total_bytes(directory):
+    """Total size of the ``*.fastq.gz`` files below ``directory``."""
+    return sum(entry.stat(follow_symlinks=False).st_size for entry in iter_fastq_entries(directory))
+
+
+def fastq_fingerprint(directory):
+    """Fingerprint of the ``*.fastq.gz`` files below ``directory`` and their total size.
+
+    The fingerprint is a SHA-256 over every file's relative path, size and mtime,
+    so it changes whenever a file is added, removed, rewritten or touched, without
+    reading any file contents.
+    """
+    entries = []
+    for entry in iter_fastq_entries(directory):
+        st = entry.stat(follow_symlinks=False)
+        entries.append((os.path.relpath(entry.path, directory), st.st_size, st.st_mtime_ns))
+    return fingerprint(entries)
+
+
+def fingerprint(entries):
+    """Fingerprint and total size of ``(relative path, size, mtime)`` fastq entries, see fastq_fingerprint."""
+    digest = hashlib.sha256()
+    total = 0
+    for path, size, mtime in sorted(entries):
+        digest.update(f"{path}\0{size}\0{mtime}\n".encode())
+        total += size
+    return digest.hexdigest(), total
+
+
+class ScanResult:
+    """Classified fastq files of a run folder."""
+
+    def __init__(self):
+        self.pairs = []  # (sample_id, forward, reverse) in the order pairs were completed
+        self.singles = []  # (sample_id, file)
+        self.orphan_forward = []  # R1 files whose R2 mate does not exist
+        self.orphan_reverse = []  # R2 files without an R1
+        self.file_count = 0
+
+    @property
+    def paired_end(self):
+        return bool(self.pairs or self.orphan_forward)
+
+
+def scan_directory(directory, on_pair=None, paths=None):
+    """Classify every fastq below ``directory`` in a single pass.
+
+    R1 and R2 files are matched through a dict keyed on the expected mate name, so
+    reads can arrive in any order. ``on_pair`` is called with each completed
+    ``(sample_id, forward, reverse)`` as soon as both mates have been seen.
+    File names are relative to ``directory`` for top-level files and absolute otherwise,
+    which is what the iridauploader directory parser accepts.
+    ``paths`` can supply already known fastq paths instead of walking ``directory``.
+    """
+    directory = os.path.abspath(directory)
+    if paths is None:
+        paths = (entry.path for entry in iter_fastq_entries(directory))
+    result = ScanResult()
+    waiting_forward = {}  # expected R2 name -> R1 name
+    waiting_reverse = set()  # R2 names whose R1 has not turned up yet
+
+    for path in paths:
+        result.file_count += 1
+        file_name = os.path.basename(path)
+        name = file_name if os.path.dirname(path) == directory else path
+        if "_R1" in file_name:
+            # Only the file name, a folder such as sub_R1x/ must not be renamed
+            mate_file = file_name.replace("_R1", "_R2")
+            mate = mate_file if name == file_name else os.path.join(os.path.dirname(path), mate_file)
+            if mate in waiting_reverse:
+                waiting_reverse.remove(mate)
+                pair = (PAIRED_REGEX.split(file_name)[0], name, mate)
+                result.pairs.append(pair)
+                if on_pair:
+                    on_pair(*pair)
+            else:
+                waiting_forward[mate] = name
+        elif "_R2" in file_name:
+            if name in waiting_forward:
+                forward = waiting_forward.pop(name)
+                pair = (PAIRED_REGEX.split(os.path.basename(forward))[0], forward, name)
+                result.pairs.append(pair)
+                if on_pair:
+                    on_pair(*pair)
+            else:
+                waiting_reverse.add(name)
+        else:
+            result.singles.append((SINGLE_REGEX.split(file_name)[0], name))
+
+    result.orphan_forward = sorted(waiting_forward.values())
+    result.orphan_reverse = sorted(waiting_reverse)
+    return result
+
+
+def write_sample_list(directory, project_id, paired_end=None, sort=False, paths=None):
+    """Scan ``directory`` once and write its ``SampleList.csv``.
+
+    Rows are written while the scan is still running unless ``sort`` is set, and
+    the file is moved into place only once it is complete. ``paths`` is passed on
+    to ``scan_directory``. Raises ValueError if an R1 file has no R2 mate.
+    """
+    sample_file = os.path.join(directory, "SampleList.csv")
+    tmp_file = f"{sample_file}.tmp"
+
+    with open(tmp_file, "w") as fh:
+        fh.write("[Data]\n")
+        fh.write("Sample_Name,Project_ID,File_Forward,File_Reverse\n")
+
+        def write_row(sample_id, forward, reverse=""):
+            fh.write(f"{sample_id}, {project_id}, {forward}, {reverse}\n")
+
+        stream_pairs = paired_end is not False and not sort
+        result = scan_directory(directory, on_pair=write_row if stream_pairs else None, paths=paths)
+
+        if paired_end is None:
+            paired_end = result.paired_end
+
+        if paired_end:
+            if result.orphan_forward:
+                fh.close()
+                os.remove(tmp_file)
+                raise ValueError(f"Missing R2 files for: {', '.join(result.orphan_forward)}")
+            if result.orphan_reverse:
+                logger.warning(f"Ignoring R2 files without an R1: {', '.join(result.orphan_reverse)}")
+            if result.singles:
+                logger.warning(f"Ignoring {len(result.singles)} unpaired fastq files in a paired-end run")
+            if not stream_pairs:
+                pairs = sorted(result.pairs, key=lambda p: os.path.basename(p[1])) if sort else result.pairs
+                for pair in pairs:
+                    write_row(*pair)
+        else:
+            # Single-end runs upload every fastq on its own, R1/R2 named files included
+            singles = result.singles + [
+                (SINGLE_REGEX.split(os.path.basename(f))[0], f)
+                for pair in result.pairs for f in pair[1:]
+            ] + [
+                (SINGLE_REGEX.split(os.path.basename(f))[0], f)
+                for f in result.orphan_forward + result.orphan_reverse
+            ]
+            if sort:
+                singles.sort(key=lambda s: os.path.basename(s[1]))
+            for sample_id, fastq in singles:
+                write_row(sample_id, fastq)
+
+    os.replace(tmp_file, sample_file)
+    logger.info(f"Scanned {result.file_count} fastq files in {directory}")
+    return sample_file
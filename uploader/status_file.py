@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+STATUS_FILE_NAME = 'irida_uploader_status.info'
+CACHE_SIZE = 128
+
+
+class UploadStatus:
+    """Parsed ``irida_uploader_status.info`` with the counters the app needs precomputed.
+
+    Instances are shared between callers through the cache, so treat them as read-only.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.status = (data.get('Upload Status') or '').lower()
+        self.run_id = data.get('Run ID')
+        self.samples = data.get('Sample Status', [])
+        self.total = len(self.samples)
+        self.uploaded_samples = [
+            {
+                'name': s['Sample Name'],
+                'project_id': s['Project ID']
+            }
+            for s in self.samples
+            if str(s.get('Uploaded', '')).lower() == 'true'
+        ]
+        self.uploaded = len(self.uploaded_samples)
+        self.project_id = next((s.get('Project ID') for s in self.samples if s.get('Project ID')), None)
+
+    @property
+    def remaining(self):
+        return self.total - self.uploaded
+
+
+_cache = OrderedDict()  # path -> (mtime_ns, size, UploadStatus)
+_cache_lock = threading.Lock()
+
+
+def status_path(directory):
+    return os.path.join(directory, STATUS_FILE_NAME)
+
+
+def read(directory):
+    """Return the UploadStatus of ``directory``, or None if it has no status file.
+
+    Parsed files are memoized on (path, mtime, size) in a small LRU, so repeated
+    reads of an unchanged file cost one stat. Raises ValueError for malformed files.
+    """
+    path = status_path(directory)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[:2] == key:
+            _cache.move_to_end(path)
+            return cached[2]
+
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+            after = os.fstat(f.fileno())
+    except FileNotFoundError:
+        return None
+    status = UploadStatus(json.loads(raw.decode()))
+
+    # Only cache what was read from a file that did not change while being read
+    if (after.st_mtime_ns, after.st_size) == key:
+        with _cache_lock:
+            _cache[path] = (key[0], key[1], status)
+            _cache.move_to_end(path)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return status
@@ -4,71 +4,75 @@ from celery.app.control import Control
 from celery.app import app_or_default
 from django.core.mail import send_mail
 from django.conf import settings
+from django import db
+from django.db import transaction
+from django.utils import timezone
 from .models import Upload, Notification
 import iridauploader.core as core
 import iridauploader.config as irida_config
 from iridauploader.model import Project
-from iridauploader.core import api_handler
+from . import (bandwidth, checkpoints, checksums, events, fair_share, fastq_check, heartbeats, irida_api, manifest, parallel_upload, project_index, scanner, status_file,
+               retries, throughput)
+from .redis_client import get_redis
+from .upload_slots import SLOTS_KEY, UploadSlots
+from celery.exceptions import Retry
 import os
-import tempfile
-import atexit
-import configparser
 import datetime
 import logging
 import pathlib
-import re
+import socket
 import time
 from logging import StreamHandler
-from io import StringIO
+from collections import deque
+import threading
 from celery import current_app
 import json
 
 logger = logging.getLogger(__name__)
 
-MAX_CONCURRENT_UPLOADS = 2
-UPLOAD_LOCK_EXPIRE = 60 * 60  # 1 hour in seconds
-
-def initialize_irida_api():
-    """Initialize the IRIDA API from Django settings."""
-    logger.info("Initializing IRIDA API")
-    settings_dict = {
-        "base_url": settings.IRIDA_API_URL,
-        "client_id": settings.IRIDA_CLIENT_ID,
-        "client_secret": settings.IRIDA_CLIENT_SECRET,
-        "username": settings.IRIDA_USERNAME,
-        "password": settings.IRIDA_PASSWORD,
-        "timeout_multiplier": settings.IRIDA_TIMEOUT,
-    }
-    logger.info(f"IRIDA settings: {settings_dict}")
-
-    # Create a temporary config file
-    temp_config = tempfile.NamedTemporaryFile(mode="w+", delete=False, suffix=".conf")
-    temp_config_path = temp_config.name
-    logger.info(f"Created temporary config file at: {temp_config_path}")
-
-    # Write config file directly without using configparser
-    with open(temp_config_path, 'w') as f:
-        f.write("[Settings]\n")
-        f.write(f"base_url = {settings_dict['base_url']}\n")
-        f.write(f"client_id = {settings_dict['client_id']}\n")
-        f.write(f"client_secret = {settings_dict['client_secret']}\n")
-        f.write(f"username = {settings_dict['username']}\n")
-        f.write(f"password = {settings_dict['password']}\n")
-        f.write(f"timeout = {settings_dict['timeout_multiplier']}\n")
-
-    # Schedule the temporary file for deletion
-    atexit.register(os.unlink, temp_config_path)
-
-    try:
-        logger.info("Attempting to initialize IRIDA API")
-        api = api_handler._initialize_api(**settings_dict)
-        logger.info("Successfully initialized IRIDA API")
-        return api, temp_config_path
-    except Exception as e:
-        logger.error(f"Failed to initialize IRIDA API: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        logger.error(f"Error args: {e.args}")
-        raise
+MAX_CONCURRENT_UPLOADS = settings.MAX_CONCURRENT_UPLOADS
+UPLOAD_SLOT_RETRY = 30  # Seconds before a waiting upload checks for a free slot again
+QUEUE_UPDATE_DELAY = 2  # Seconds to gather queue transitions into one notification update
+QUEUE_SNAPSHOT_KEY = 'iuw:queue-snapshot'
+QUEUE_SNAPSHOT_VERSION_KEY = 'iuw:queue-snapshot:version'
+QUEUE_SNAPSHOT_EXPIRE = 5 * 60  # Upper bound on staleness should an invalidation be lost
+
+# Store a rebuilt snapshot only if no transition happened while it was being built
+_SET_QUEUE_SNAPSHOT = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+"""
+PROJECT_LOCK_EXPIRE = 5 * 60  # 5 minutes in seconds
+NOTIFICATION_FLUSH_SECONDS = 5
+NOTIFICATION_FLUSH_SIZE = 50
+MAX_UPLOAD_NOTIFICATIONS = 100  # Error notifications per upload before they are summarised
+LOG_BUFFER_LINES = 1000  # Recent IRIDA log lines kept in memory per upload
+
+# Express and bulk uploads have separate slots so small uploads never wait behind large ones
+upload_slots = {
+    'bulk': UploadSlots(
+        MAX_CONCURRENT_UPLOADS,
+        lease_seconds=settings.UPLOAD_LEASE_SECONDS,
+        renew_seconds=settings.UPLOAD_LEASE_SECONDS / 5,
+    ),
+    'express': UploadSlots(
+        settings.MAX_CONCURRENT_EXPRESS_UPLOADS,
+        lease_seconds=settings.UPLOAD_LEASE_SECONDS,
+        renew_seconds=settings.UPLOAD_LEASE_SECONDS / 5,
+        key=f"{SLOTS_KEY}:express",
+    ),
+}
+
+def wait_for_upload_slot(task, **kwargs):
+    """Re-queue ``task`` to run again shortly with ``kwargs``, without counting it as a retry.
+
+    The worker is free to run other tasks in the meantime.
+    """
+    sig = task.signature_from_request(task.request, kwargs=kwargs, countdown=UPLOAD_SLOT_RETRY,
+                                      retries=task.request.retries)
+    sig.apply_async()
+    return Retry("Waiting for an upload slot", when=UPLOAD_SLOT_RETRY, sig=sig)
 
 def create_irida_project(name, project_description=None):
     """Create a project in IRIDA."""
@@ -76,29 +80,72 @@ def create_irida_project(name, project_description=None):
         project_description = f"Created on {datetime.date.today()} via IUW"
     try:
         logger.info(f"Creating IRIDA project: {name}")
-        _api, _ = initialize_irida_api()
-        logger.info("Getting list of existing projects")
-        projects_list = _api.get_projects()
-        existed_project = [prj.id for prj in projects_list if prj.name == name]
-        
-        if len(existed_project) == 0:
-            logger.info("Project doesn't exist, creating new one")
-            new_project = Project(name, project_description)
-            created_project = _api.send_project(new_project)
-            project_id = created_project['resource']['identifier']
-            logger.info(f"Created new project with ID: {project_id}")
+        project_id = project_index.lookup(name)
+        if project_id is not None:
+            logger.info(f"Project already exists with ID: {project_id}")
             return project_id
-        else:
-            logger.info(f"Project already exists with ID: {existed_project[0]}")
-            return existed_project[0]
+
+        # Serialise creation per name so concurrent submissions don't both create the project
+        lock = get_redis().lock(f"iuw:irida-project:{name}", timeout=PROJECT_LOCK_EXPIRE,
+                                blocking_timeout=PROJECT_LOCK_EXPIRE)
+        with lock, irida_api.get_pool().client() as _api:
+            logger.info("Looking up project in the project index")
+            project_id = project_index.find(_api, name)
+
+            if project_id is None:
+                logger.info("Project doesn't exist, creating new one")
+                new_project = Project(name, project_description)
+                created_project = _api.send_project(new_project)
+                project_id = created_project['resource']['identifier']
+                project_index.record(name, project_id)
+                logger.info(f"Created new project with ID: {project_id}")
+                return project_id
+            else:
+                logger.info(f"Project already exists with ID: {project_id}")
+                return project_id
     except Exception as e:
         logger.error(f"Error creating IRIDA project: {str(e)}")
         raise
 
+def read_sample_list_project_id(sample_file):
+    """Return the project ID of the first sample in a SampleList.csv."""
+    with open(sample_file, 'r') as f:
+        next(f)  # Skip [Data]
+        next(f)  # Skip column headers
+        first_line = next(f).strip()
+        return first_line.split(',')[1].strip()
+
+def read_sample_list_files(sample_file):
+    """Absolute paths of the fastq files listed in ``sample_file``."""
+    directory = os.path.dirname(os.path.abspath(sample_file))
+    paths = []
+    with open(sample_file, 'r') as f:
+        next(f)  # Skip [Data]
+        next(f)  # Skip column headers
+        for line in f:
+            for name in line.split(',')[2:4]:
+                name = name.strip()
+                if name:
+                    paths.append(os.path.join(directory, name))
+    return paths
+
 def prepare_sample_list(directory_path, pattern=None, project_id=None, 
                        project_name=None, paired_end=None, sort=False):
-    """Prepare sample list for IRIDA upload."""
+    """Prepare sample list for IRIDA upload.
+
+    A SampleList.csv that was not generated here is used as it is. A generated one
+    is only rebuilt when the fastq files in the folder changed since it was written.
+    """
     p = pathlib.Path(directory_path)
+    sample_file = p.joinpath("SampleList.csv")
+    cached = manifest.Manifest.load(p)
+
+    if sample_file.exists() and not cached.owns(sample_file):
+        logger.info(f"Using existing sample list {sample_file}")
+        return str(sample_file), read_sample_list_project_id(sample_file)
+
+    if project_id is None and sample_file.exists():
+        project_id = cached.project_id
 
     if project_id is None:
         if project_name is None:
@@ -107,89 +154,171 @@ def prepare_sample_list(directory_path, pattern=None, project_id=None,
         
         project_id = create_irida_project(name=project_name)
 
-    # Auto-detect paired_end if not specified
-    if paired_end is None:
-        r1_files = list(p.rglob("*_R1*.fastq.gz"))
-        single_end_files = list(p.rglob("*.fastq.gz"))
-        single_end_files = [f for f in single_end_files if not ("_R1" in f.name or "_R2" in f.name)]
-        paired_end = len(r1_files) > 0
+    options = {'paired_end': paired_end, 'sort': sort}
+    cached.refresh()
+    if cached.matches(sample_file, project_id, options):
+        logger.info(f"Folder unchanged since {sample_file} was generated, reusing it")
+        return str(sample_file), project_id
 
-    if paired_end:
-        pattern = "*_R1*.fastq.gz"
-        regex = re.compile("_S[0-9]{1,3}|_R[12].|_1.non_host.fastq.gz|_2.non_host.fastq.gz")
-    else:
-        pattern = "*.fastq.gz"
-        regex = re.compile(".fastq|.fq.")
-
-    fastqs = list(p.rglob(pattern))
-    fastq_names = [fq.name for fq in fastqs]
-    _sorted_fastq_names = sorted(fastq_names) if sort else fastq_names
-
-    sample_ids = [regex.split(sp)[0] for sp in _sorted_fastq_names]
-    sample_file = p.joinpath("SampleList.csv")
-
-    with sample_file.open(mode="w") as fh:
-        fh.write("[Data]\n")
-        fh.write("Sample_Name,Project_ID,File_Forward,File_Reverse\n")
-        for i, fastq in enumerate(_sorted_fastq_names):
-            if paired_end:
-                if "_R1" in fastq:
-                    reverse_reads = fastq.replace("_R1", "_R2")
-                elif "_R1.non_host.fastq.gz" in fastq:
-                    reverse_reads = fastq.replace("_R1.non_host.fastq.gz", "_R2.non_host.fastq.gz")
-                else:
-                    raise ValueError(f"Invalid file name: {fastq}")
-            else:
-                reverse_reads = ""
-            fh.write(f"{sample_ids[i]}, {project_id}, {fastq}, {reverse_reads}\n")
+    logger.info(f"Building sample list, {cached.relisted} folders listed")
+    sample_file = scanner.write_sample_list(str(p), project_id, paired_end=paired_end, sort=sort,
+                                            paths=cached.fastq_paths())
+    cached.save(sample_file, project_id, options)
 
     return sample_file, project_id
 
 class NotificationLogHandler(StreamHandler):
-    def __init__(self, upload_id, user_id):
+    """Turns ERROR records from the IRIDA uploader into notifications for the user.
+
+    Notifications are queued and written with a single ``bulk_create`` once
+    ``flush_size`` distinct messages are pending or ``flush_interval`` seconds
+    after the first one arrived. Repeats of a pending message are merged into it.
+    At most ``max_notifications`` are created per upload, the rest are summarised
+    when the handler closes. Only the last ``max_lines`` log lines are kept.
+    """
+
+    def __init__(self, upload_id, user_id, flush_interval=NOTIFICATION_FLUSH_SECONDS,
+                 flush_size=NOTIFICATION_FLUSH_SIZE, max_notifications=MAX_UPLOAD_NOTIFICATIONS,
+                 max_lines=LOG_BUFFER_LINES):
         super().__init__()
         self.upload_id = upload_id
         self.user_id = user_id
-        self.buffer = StringIO()
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_notifications = max_notifications
+        self.buffer = deque(maxlen=max_lines)
+        self._pending = {}  # message -> number of times it was logged
+        self._pending_lock = threading.Lock()
+        self._timer = None
+        self._created = 0
+        self._suppressed = 0
 
     def emit(self, record):
-        msg = self.format(record)
-        self.buffer.write(msg + '\n')
-        
-        # Create notification for errors
-        if record.levelno >= logging.ERROR:
-            Notification.objects.create(
-                user_id=self.user_id,
-                title='Upload Error',
-                message=msg,
-                type='error',
-                related_upload_id=self.upload_id
-            )
+        try:
+            msg = self.format(record)
+            self.buffer.append(msg)
+            events.publish_log(self.user_id, self.upload_id)
+
+            # Create notification for errors
+            if record.levelno >= logging.ERROR:
+                with self._pending_lock:
+                    self._pending[msg] = self._pending.get(msg, 0) + 1
+                    flush_now = len(self._pending) >= self.flush_size
+                    if not flush_now and self._timer is None:
+                        self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                        self._timer.daemon = True
+                        self._timer.start()
+                if flush_now:
+                    self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread opened its own database connection
+            db.connection.close()
+
+    def flush(self):
+        with self._pending_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            room = max(0, self.max_notifications - self._created)
+            batch = list(pending.items())[:room]
+            self._suppressed += sum(count for _, count in list(pending.items())[room:])
+            self._created += len(batch)
+        if not batch:
+            return
+        try:
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=self.user_id,
+                    title='Upload Error',
+                    message=msg if count == 1 else f"{msg} (repeated {count} times)",
+                    type='error',
+                    related_upload_id=self.upload_id
+                )
+                for msg, count in batch
+            ])
+        except Exception as e:
+            logger.error(f"Failed to create error notifications: {str(e)}")
 
     def close(self):
-        self.buffer.close()
+        self.flush()
+        events.forget_log(self.upload_id)
+        if self._suppressed:
+            try:
+                Notification.objects.create(
+                    user_id=self.user_id,
+                    title='Upload Error',
+                    message=f"{self._suppressed} further errors were not shown, see the upload log for details",
+                    type='error',
+                    related_upload_id=self.upload_id
+                )
+            except Exception as e:
+                logger.error(f"Failed to create error notifications: {str(e)}")
+            self._suppressed = 0
+        self.buffer.clear()
         super().close()
 
 def get_queue_info_tasks():
     """Get information about current queue status"""
     try:
         # Get uploads that are in 'submitted' or 'uploading' status from database
-        queued_uploads = Upload.objects.filter(status__in=['submitted', 'uploading']).order_by('created_at')
-        running_uploads = Upload.objects.filter(status='uploading').count()
+        uploads = Upload.objects.filter(status__in=['submitted', 'uploading']).select_related('user').order_by('created_at')
+        running = [upload for upload in uploads if upload.status == 'uploading']
+        running_uploads = len(running)
+
+        # Running uploads first, then waiting ones in the order they will get a slot,
+        # express before bulk as express uploads only wait for each other
+        waiting = []
+        for queue in ('express', 'bulk'):
+            counts = {}
+            for upload in running:
+                if upload.queue == queue:
+                    counts[upload.user_id] = counts.get(upload.user_id, 0) + 1
+            waiting += fair_share.fair_order(
+                [upload for upload in uploads if upload.status == 'submitted' and upload.queue == queue], counts
+            )
         
+        # Predicted finish of running uploads and start of waiting ones from the rolling throughput
+        progress = {}
+        for upload in running:
+            try:
+                run_status = status_file.read(upload.get_full_path())
+            except (ValueError, OSError) as e:
+                # The uploader rewrites the file in place, so it can be caught half-written
+                logger.warning(f"Skipping progress of upload {upload.id}, unreadable status file: {str(e)}")
+                continue
+            if run_status:
+                progress[upload.id] = (run_status.uploaded, run_status.total)
+        limits = {queue: slots.limit for queue, slots in upload_slots.items()}
+        estimates = throughput.estimate(running + waiting, throughput.rates(), limits, progress)
+
         all_tasks = []
-        for upload in queued_uploads:
+        for upload in running + waiting:
+            estimate = estimates[upload.id]
             all_tasks.append({
                 'id': f'db-{upload.id}',
+                'upload_id': upload.id,
+                'user_id': upload.user_id,
                 'folder_name': upload.folder_name,
                 'status': upload.status,
-                'user': upload.user.email
+                'queue': upload.queue,
+                'user': upload.user.email,
+                'estimated_start': estimate['estimated_start'] and estimate['estimated_start'].isoformat(),
+                'eta': estimate['eta'] and estimate['eta'].isoformat()
             })
         
         return {
             'total_in_queue': len(all_tasks),
             'running_uploads': running_uploads,
-            'max_concurrent_uploads': MAX_CONCURRENT_UPLOADS,
+            # Express slots come on top of the bulk ones
+            'max_concurrent_uploads': sum(slots.limit for slots in upload_slots.values()),
+            'max_concurrent_express_uploads': upload_slots['express'].limit,
             'tasks': all_tasks
         }
         
@@ -198,10 +327,114 @@ def get_queue_info_tasks():
         return {
             'total_in_queue': 0,
             'running_uploads': 0,
-            'max_concurrent_uploads': MAX_CONCURRENT_UPLOADS,
-            'tasks': []
+            'max_concurrent_uploads': sum(slots.limit for slots in upload_slots.values()),
+            'max_concurrent_express_uploads': upload_slots['express'].limit,
+            'tasks': [],
+            'error': 'Queue information is currently unavailable'
         }
 
+def enqueue_upload(upload, force_upload=False):
+    """Send process_upload to the express or bulk queue depending on the folder's fastq size."""
+    if upload.total_bytes is None:
+        folder_path = os.path.join(upload.user.get_upload_dir(), upload.folder_name)
+        upload.total_bytes = scanner.fastq_total_bytes(folder_path)
+    upload.queue = 'express' if upload.total_bytes <= settings.EXPRESS_UPLOAD_MAX_BYTES else 'bulk'
+    upload.force_upload = force_upload
+    task = process_upload.apply_async((upload.id, force_upload), queue=upload.queue)
+    upload.task_id = task.id
+    upload.save()
+    logger.info(f"Upload {upload.id} ({upload.total_bytes} bytes) queued on {upload.queue}")
+    return task
+
+def fingerprint_folder(folder_path):
+    """``scanner.fastq_fingerprint`` of ``folder_path`` from its manifest listing.
+
+    Only folders whose mtime changed since the last listing are read again. The
+    listing is saved, so building the sample list afterwards only restats the files.
+    """
+    cached = manifest.Manifest.load(folder_path)
+    cached.refresh()
+    try:
+        cached.save_listing()
+    except OSError as e:
+        logger.warning(f"Could not save the folder listing of {folder_path}: {str(e)}")
+    return cached.folder_fingerprint()
+
+@shared_task
+def fingerprint_upload(upload_id, new=False):
+    """Fingerprint the folder of a submitted upload, so the web request does not walk it.
+
+    A ``new`` upload is then queued. For a resubmission, a queued upload takes the
+    new fingerprint, as its task scans the folder when it starts, while the user is
+    told when the folder of a running upload changed since it was submitted.
+    """
+    upload = Upload.objects.select_related('user').get(id=upload_id)
+    if upload.status not in Upload.ACTIVE_STATUSES:
+        return
+    folder_path = os.path.join(upload.user.get_upload_dir(), upload.folder_name)
+    try:
+        fingerprint, total_bytes = fingerprint_folder(folder_path)
+    except Exception as e:
+        logger.error(f"Could not read folder {folder_path} of upload {upload.id}: {str(e)}")
+        if new:
+            upload.status = 'failed'
+            upload.save()
+            create_notification.delay(upload.user_id, upload.id, 'error')
+        return
+
+    if new:
+        upload.fingerprint = fingerprint
+        upload.total_bytes = total_bytes
+        enqueue_upload(upload, upload.force_upload)
+    elif upload.fingerprint is None or upload.fingerprint == fingerprint:
+        # Not queued yet, or nothing changed
+        return
+    elif upload.status == 'submitted':
+        Upload.objects.filter(id=upload.id, status='submitted').update(fingerprint=fingerprint, total_bytes=total_bytes)
+    else:
+        logger.info(f"Folder {upload.folder_name} changed while upload {upload.id} is running")
+        Notification.objects.create(
+            user_id=upload.user_id,
+            title='Folder Changed',
+            message=f'{upload.folder_name} is being uploaded and its files have changed since. '
+                    'Please submit it again once the current upload has finished.',
+            type='error',
+            related_upload=upload
+        )
+
+def get_queue_snapshot():
+    """Queue info as built by get_queue_info_tasks, cached in Redis until the queue changes."""
+    try:
+        redis_client = get_redis()
+        cached = redis_client.get(QUEUE_SNAPSHOT_KEY)
+        if cached is not None:
+            return json.loads(cached)
+        version = redis_client.get(QUEUE_SNAPSHOT_VERSION_KEY) or b''
+    except Exception as e:
+        logger.error(f"Error reading queue snapshot: {str(e)}")
+        return get_queue_info_tasks()
+
+    queue_info = get_queue_info_tasks()
+    if 'error' in queue_info:
+        return queue_info
+    try:
+        redis_client.eval(_SET_QUEUE_SNAPSHOT, 2, QUEUE_SNAPSHOT_KEY, QUEUE_SNAPSHOT_VERSION_KEY,
+                          version, json.dumps(queue_info), QUEUE_SNAPSHOT_EXPIRE)
+    except Exception as e:
+        logger.error(f"Error storing queue snapshot: {str(e)}")
+    return queue_info
+
+def queue_changed():
+    """Called after an upload enters or leaves the queue: drop the snapshot and update notifications."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(QUEUE_SNAPSHOT_VERSION_KEY)
+        pipe.delete(QUEUE_SNAPSHOT_KEY)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to invalidate queue snapshot: {str(e)}")
+    schedule_queue_update()
+
 @shared_task
 def send_email_notification(recipient_email, subject, message):
     """Send email notification as a Celery task."""
@@ -218,8 +451,12 @@ def send_email_notification(recipient_email, subject, message):
         logger.error(f"Failed to send email notification: {str(e)}")
 
 @shared_task(bind=True, max_retries=5, time_limit=86400, soft_time_limit=82800)
-def process_upload(self, upload_id, force_upload=False):
-    """Process file upload and send to IRIDA."""
+def process_upload(self, upload_id, force_upload=False, prepared=False, continue_upload=False):
+    """Process file upload and send to IRIDA.
+
+    ``prepared`` is set when the task is re-queued to wait for an upload slot, so the
+    sample list and fastq validation done before the wait are not repeated.
+    """
     try:
         logger.info(f"Starting upload process for upload_id: {upload_id}")
         upload = Upload.objects.get(id=upload_id)
@@ -228,8 +465,17 @@ def process_upload(self, upload_id, force_upload=False):
         current_retries = self.request.retries
         logger.info(f"Current retry attempt: {current_retries + 1} of {self.max_retries + 1}")
         
-        upload.status = 'uploading'
-        upload.save()
+        # A retry of a failed upload must not run alongside a newer submission of its folder
+        if upload.status not in Upload.ACTIVE_STATUSES and Upload.objects.filter(
+                user_id=upload.user_id, folder_name=upload.folder_name,
+                status__in=Upload.ACTIVE_STATUSES).exclude(id=upload_id).exists():
+            logger.info(f"Upload {upload_id} was superseded by a newer upload of {upload.folder_name}, not retrying")
+            return
+
+        # The upload only counts as running once it holds an upload slot
+        if upload.status != 'submitted':
+            upload.status = 'submitted'
+            upload.save()
 
         # Set up log capture
         irida_logger = logging.getLogger('iridauploader')
@@ -243,90 +489,108 @@ def process_upload(self, upload_id, force_upload=False):
             target_dir = os.path.join(user_dir, upload.folder_name)
             logger.info(f"Processing files in directory: {target_dir}")         
             
-            # Initialize upload status variables
-            status_file = os.path.join(target_dir, "irida_uploader_status.info")
-            continue_upload = False
-            if os.path.exists(status_file):
-                with open(status_file, 'r') as f:
-                    status_data = json.load(f)
-                    if status_data.get("Upload Status", "").lower() == "partial":
-                        continue_upload = True
-                        logger.info("Found partial upload, will continue from where it left off")
+            if prepared:
+                logger.info("Sample list was prepared and validated before waiting for an upload slot")
+            else:
+                # Initialize upload status variables
+                run_status = status_file.read(target_dir)
+                if run_status and run_status.status == "partial":
+                    continue_upload = True
+                    logger.info("Found partial upload, will continue from where it left off")
             
-            # Check status file for completed upload
-            if os.path.exists(status_file):
-                with open(status_file, 'r') as f:
-                    status_data = json.load(f)
-                    if status_data.get("Upload Status", "").lower() == "complete" and not force_upload:
-                        logger.info("Upload already complete, skipping")
-                        upload.status = 'success'
-                        upload.save()
-                        send_email_notification.delay(
-                            upload.user.email,
-                            'Upload Complete',
-                            f'Your upload of {upload.folder_name} was already completed successfully.'
-                        )
-                        return
-
-            # Prepare sample list and get project ID
-            try:
-                logger.info("Preparing sample list and creating IRIDA project")
-                subfolder_name = os.path.basename(target_dir)
-                run_date = datetime.date.today().strftime("%y%m%d")
-                project_name = upload.project_name if upload.project_name else f"QIB-{subfolder_name}-{run_date}"
-                logger.info(f"Using project name: {project_name}")
+                # Check status file for completed upload
+                if run_status and run_status.status == "complete" and not force_upload:
+                    logger.info("Upload already complete, skipping")
+                    upload.status = 'success'
+                    upload.save()
+                    send_email_notification.delay(
+                        upload.user.email,
+                        'Upload Complete',
+                        f'Your upload of {upload.folder_name} was already completed successfully.'
+                    )
+                    return
+
+                # Prepare sample list and get project ID
+                try:
+                    logger.info("Preparing sample list and creating IRIDA project")
+                    subfolder_name = os.path.basename(target_dir)
+                    run_date = datetime.date.today().strftime("%y%m%d")
+                    project_name = upload.project_name if upload.project_name else f"QIB-{subfolder_name}-{run_date}"
+                    logger.info(f"Using project name: {project_name}")
                 
-                # Only prepare sample list if one doesn't exist
-                sample_list = os.path.join(target_dir, "SampleList.csv")
-                if not os.path.exists(sample_list):
+                    # Reuses an existing sample list unless the folder changed since it was generated
                     sample_list, project_id = prepare_sample_list(
                         directory_path=target_dir,
                         project_name=project_name
                     )
-                else:
-                    # Get project ID from existing sample list
+
+                    # Update upload with project ID and sample count
                     with open(sample_list, 'r') as f:
                         next(f)  # Skip [Data]
                         next(f)  # Skip column headers
-                        first_line = next(f).strip()
-                        project_id = first_line.split(',')[1].strip()
-
-                # Update upload with project ID and sample count
-                with open(sample_list, 'r') as f:
-                    next(f)  # Skip [Data]
-                    next(f)  # Skip column headers
-                    total_samples = sum(1 for line in f)
+                        total_samples = sum(1 for line in f)
                 
-                # If continuing a partial upload, count only remaining samples
-                if continue_upload and os.path.exists(status_file):
-                    with open(status_file, 'r') as f:
-                        status_data = json.load(f)
-                        uploaded_samples = sum(
-                            1 for sample in status_data.get("Sample Status", [])
-                            if sample.get("Uploaded", "").lower() == "true"
-                        )
+                    # If continuing a partial upload, count only remaining samples
+                    if continue_upload:
+                        uploaded_samples = run_status.uploaded
                         remaining_samples = total_samples - uploaded_samples
                         logger.info(f"Continuing partial upload: {uploaded_samples} samples already uploaded, {remaining_samples} remaining")
                         upload.sample_count = remaining_samples
-                else:
-                    upload.sample_count = total_samples
+                    else:
+                        upload.sample_count = total_samples
                     
-                upload.irida_project_id = project_id
-                upload.save()
+                    upload.irida_project_id = project_id
+                    upload.save()
                 
-                logger.info(f"Sample list processed with {upload.sample_count} samples to upload, project ID: {project_id}")
+                    logger.info(f"Sample list processed with {upload.sample_count} samples to upload, project ID: {project_id}")
                 
-            except Exception as e:
-                logger.error(f"Error preparing sample list: {str(e)}")
-                raise e
+                except Exception as e:
+                    logger.error(f"Error preparing sample list: {str(e)}")
+                    raise e
+
+                # Catch truncated or corrupt files before anything is sent; unchanged files are not read again
+                try:
+                    reads = fastq_check.validate_run(target_dir, read_sample_list_files(sample_list),
+                                                     workers=settings.FASTQ_VALIDATION_WORKERS or None)
+                    logger.info(f"Validated {len(reads)} fastq files with {sum(reads.values())} reads")
+                except fastq_check.FastqValidationError as e:
+                    logger.error(str(e))
+                    raise
+                except OSError as e:
+                    # The files could not be listed or the cache written, e.g. a share that went away; retried
+                    logger.error(f"Could not validate fastq files: {str(e)}")
+                    raise
+                except Exception as e:
+                    # A failure of the validation itself must not block uploads; IRIDA still checks what it receives
+                    logger.warning(f"Fastq validation did not run, uploading unvalidated: {str(e)}")
+
+            # Transfers are limited across all worker hosts and free slots go to uploads in
+            # fair-share order; wait outside the worker until this upload's turn comes
+            slot_holder = f"upload-{upload_id}"
+            slots = upload_slots[upload.queue]
+            fair_share.mark_waiting(upload_id, upload.queue)
+            free_slots = slots.limit - slots.in_use()
+            if not (fair_share.dispatch_allowed(upload_id, upload.queue, free_slots, max_age=3 * UPLOAD_SLOT_RETRY)
+                    and slots.try_acquire(slot_holder)):
+                logger.info(f"Upload {upload_id} is waiting for its turn, "
+                            f"{free_slots} of {slots.limit} {upload.queue} upload slots free")
+                raise wait_for_upload_slot(self, prepared=True, continue_upload=continue_upload)
+            fair_share.clear_waiting(upload_id, upload.queue)
+            upload.status = 'uploading'
+            upload.started_at = timezone.now()
+            upload.finished_at = None
+            upload.bytes_transferred = 0
+            upload.worker_host = socket.gethostname()
+            upload.save()
 
             # Upload to IRIDA
             try:
                 logger.info(f"Starting IRIDA upload for directory: {target_dir}")
                 logger.info("Initializing IRIDA API for upload")
                 
-                # Initialize API and get config path
-                api, config_path = initialize_irida_api()
+                # Borrow an authenticated client from the worker pool
+                pool = irida_api.get_pool()
+                config_path = pool.config_path
                 logger.info(f"Using config file: {config_path}")
                 
                 # Set up configuration
@@ -336,18 +600,56 @@ def process_upload(self, upload_id, force_upload=False):
                 
                 # Perform the upload
                 logger.info(f"Starting upload_run_single_entry (force={force_upload}, continue={continue_upload})")
-                result = core.upload.upload_run_single_entry(
-                    target_dir,
-                    force_upload=force_upload,
-                    upload_mode="default",
-                    continue_upload=continue_upload
-                )
+                workers = settings.IRIDA_UPLOAD_WORKERS
+                logger.info(f"Uploading samples with {workers} parallel workers")
+                rates = throughput.rates()
+                def on_progress(uploaded, total):
+                    seconds = throughput.remaining_seconds(upload, rates, uploaded, total)
+                    eta = None if seconds is None else (timezone.now() + datetime.timedelta(seconds=seconds)).isoformat()
+                    events.publish_progress(upload.user_id, upload.id, uploaded, total, eta=eta)
+
+                sent_lock = threading.Lock()
+                def on_sent(nbytes):
+                    with sent_lock:
+                        upload.bytes_transferred += nbytes
+
+                # All transfers draw from shared bandwidth buckets so together they stay under the uplink limit
+                try:
+                    bandwidth.sync_limits()
+                except Exception as e:
+                    logger.warning(f"Could not load bandwidth limits: {str(e)}")
+                throttle = bandwidth.Throttle(upload.user_id)
+                heartbeat = heartbeats.Heartbeat(upload.id)
+                heartbeat.start()
+
+                # The lease is renewed from a thread and only lapses if the worker dies; the heartbeat
+                # comes from the transfer itself and also stops if it hangs.
+                # A forced re-upload only sends the files that changed since they were last sent,
+                # unless the user asked to resend everything
+                with slots.keep_alive(slot_holder), pool.client() as api, \
+                        irida_api.library_client(api), \
+                        parallel_upload.parallel_samples(workers, on_progress=on_progress, on_sent=on_sent,
+                                                         throttle=throttle, heartbeat=heartbeat,
+                                                         reuse_unchanged=force_upload and not upload.resend_all):
+                    result = core.upload.upload_run_single_entry(
+                        target_dir,
+                        force_upload=force_upload,
+                        upload_mode="default",
+                        continue_upload=continue_upload
+                    )
                 logger.info(f"Upload result: {result}")
                 logger.info(f"Upload exit code: {result.exit_code}")
 
+                # Hashed from the buffers that were sent, so recording them cost no extra reads
+                upload.checksums = checkpoints.CheckpointStore(target_dir).checksums(target_dir)
+                logger.info(f"Recorded checksums of {len(upload.checksums)} files")
+
+                upload.finished_at = timezone.now()
                 if result.exit_code == 0:
                     upload.status = 'success'
                     logger.info("IRIDA upload completed successfully")
+                    throughput.record(upload.worker_host, upload.bytes_transferred,
+                                      (upload.finished_at - upload.started_at).total_seconds())
                     # Send success email asynchronously
                     send_email_notification.delay(
                         upload.user.email,
@@ -357,11 +659,15 @@ def process_upload(self, upload_id, force_upload=False):
                 else:
                     upload.status = 'failed'
                     logger.error(f"IRIDA upload failed with exit code {result.exit_code}")
+                    message = f'Your upload of {upload.folder_name} has failed. Please check the log file in the upload folder for more details.'
+                    if isinstance(result.error, parallel_upload.SamplesFailedError):
+                        # The status file was left PARTIAL, so the next submission continues the run
+                        message += '\n\nThe other samples were uploaded. Submitting the folder again sends only the samples that failed.'
                     # Send failure email asynchronously
                     send_email_notification.delay(
                         upload.user.email,
                         f'Upload {upload.folder_name} Failed 💔',
-                        f'Your upload of {upload.folder_name} has failed. Please check the log file in the upload folder for more details.'
+                        message
                     )
                 upload.save()
 
@@ -370,6 +676,7 @@ def process_upload(self, upload_id, force_upload=False):
                 logger.error(f"Error type: {type(e)}")
                 logger.error(f"Error args: {e.args}")
                 upload.status = 'failed'
+                upload.finished_at = timezone.now()
                 upload.save()
                 # Send failure email asynchronously
                 send_email_notification.delay(
@@ -378,6 +685,12 @@ def process_upload(self, upload_id, force_upload=False):
                     f'Your upload of {settings.UPLOAD_ROOT}/{upload.folder_name} has failed due to an error. Please contact support for assistance.'
                 )
                 raise e
+            finally:
+                heartbeats.Heartbeat(upload.id).stop()
+                try:
+                    slots.release(slot_holder)
+                except Exception as e:
+                    logger.warning(f"Could not release upload slot of {slot_holder}: {str(e)}")
             
             # Try to create notification, but don't fail if it doesn't work
             try:
@@ -394,6 +707,8 @@ def process_upload(self, upload_id, force_upload=False):
             irida_logger.removeHandler(notification_handler)
             notification_handler.close()
 
+    except Retry:
+        raise
     except Exception as exc:
         logger.error(f"Error processing upload {upload_id}: {str(exc)}")
         try:
@@ -401,14 +716,23 @@ def process_upload(self, upload_id, force_upload=False):
             upload.status = 'failed'
             upload.save()
             
-            # Always retry on failure unless max retries reached
-            if self.request.retries < self.max_retries:
+            # Retry unless the error cannot go away or max retries reached. Errors during the
+            # transfer never get here: upload_run_single_entry returns them as its exit code,
+            # and failed samples were already retried one by one, see parallel_upload
+            if self.request.retries < self.max_retries and retries.is_retryable(exc):
                 logger.info(f"Retrying upload {upload_id}. Attempt {self.request.retries + 1} of {self.max_retries}")
-                # Exponential backoff: 1min, 2min, 4min, 8min, 16min between retries
-                countdown = 60 * (2 ** self.request.retries)
-                raise self.retry(exc=exc, countdown=countdown)
+                # Jittered backoff growing from 1 min, so uploads that failed together do not retry together
+                countdown = retries.decorrelated_jitter(60 * (2 ** self.request.retries) / 3, 60, 3600)
+                raise self.retry(exc=exc, countdown=countdown, kwargs={})  # Prepared again
             else:
-                logger.error(f"Upload {upload_id} failed after {self.max_retries} retries")
+                if retries.is_retryable(exc):
+                    logger.error(f"Upload {upload_id} failed after {self.max_retries} retries")
+                    subject = 'Upload Failed - All Retries Exhausted'
+                    message = f'Your upload of {upload.folder_name} has failed after {self.max_retries} attempts. Please contact support for assistance.'
+                else:
+                    logger.error(f"Upload {upload_id} failed with an error a retry cannot fix")
+                    subject = 'Upload Failed'
+                    message = f'Your upload of {upload.folder_name} has failed: {str(exc)}\n\nPlease check the folder and submit it again.'
                 try:
                     create_notification.delay(
                         upload.user.id,
@@ -416,11 +740,7 @@ def process_upload(self, upload_id, force_upload=False):
                         'error'
                     )
                     # Send final failure email
-                    send_email_notification.delay(
-                        upload.user.email,
-                        'Upload Failed - All Retries Exhausted',
-                        f'Your upload of {upload.folder_name} has failed after {self.max_retries} attempts. Please contact support for assistance.'
-                    )
+                    send_email_notification.delay(upload.user.email, subject, message)
                 except Exception as e:
                     logger.error(f"Failed to create error notification: {str(e)}")
         except Upload.DoesNotExist:
@@ -428,6 +748,78 @@ def process_upload(self, upload_id, force_upload=False):
         except Exception as e:
             logger.error(f"Error handling upload failure: {str(e)}")
 
+@shared_task
+def compute_checksums(upload_id):
+    """Checksum-only mode: record the MD5 and SHA-256 of every fastq of an already uploaded folder.
+
+    Checksums taken while the files were sent are reused; only files without one
+    are read.
+    """
+    upload = Upload.objects.select_related('user').get(id=upload_id)
+    directory = upload.get_full_path()
+    paths = read_sample_list_files(os.path.join(directory, 'SampleList.csv'))
+    known = checkpoints.CheckpointStore(directory).checksums(directory)
+    missing = [path for path in paths if os.path.relpath(path, directory) not in known]
+    logger.info(f"Checksumming {len(missing)} of {len(paths)} files of upload {upload_id}, "
+                f"{len(known)} known from the transfer")
+    computed = checksums.hash_files(directory, missing, workers=settings.IRIDA_UPLOAD_WORKERS)
+    listed = set(paths)
+    upload.checksums = {
+        relpath: digest for relpath, digest in {**known, **computed}.items()
+        if os.path.join(directory, relpath) in listed
+    }
+    upload.save(update_fields=['checksums'])
+    return len(upload.checksums)
+
+@shared_task
+def reap_stuck_uploads():
+    """Resume uploads whose transfer stopped making progress.
+
+    The transfer beats as it reads files and finishes samples, see
+    heartbeats.Heartbeat. An upload without a heartbeat for UPLOAD_HEARTBEAT_TIMEOUT
+    seconds whose worker is gone, i.e. whose upload slot lease expired, is set
+    back to submitted and queued again; the task continues it from the status
+    file. If the worker still holds the lease the transfer hangs, so its task is
+    terminated first and the upload is resumed on a later run once the lease
+    has expired.
+    """
+    try:
+        beats = heartbeats.last_beats()
+    except Exception as e:
+        logger.error(f"Cannot check upload heartbeats: {str(e)}")
+        return
+
+    now = time.time()
+    timeout = settings.UPLOAD_HEARTBEAT_TIMEOUT
+    for upload in Upload.objects.filter(status='uploading'):
+        last = beats.get(upload.id) or (upload.started_at.timestamp() if upload.started_at else 0)
+        if now - last < timeout:
+            continue
+
+        slot_holder = f"upload-{upload.id}"
+        try:
+            if upload_slots[upload.queue].holds(slot_holder):
+                logger.warning(f"Upload {upload.id} made no progress for {now - last:.0f}s, terminating its task")
+                if upload.task_id:
+                    current_app.control.revoke(upload.task_id, terminate=True)
+                continue
+        except Exception as e:
+            logger.error(f"Cannot check upload slot of {upload.id}: {str(e)}")
+            continue
+
+        with transaction.atomic():
+            upload = Upload.objects.select_for_update().get(id=upload.id)
+            if upload.status != 'uploading':
+                continue
+            logger.warning(f"Upload {upload.id} lost its worker {upload.worker_host}, resuming it")
+            upload.status = 'submitted'
+            upload.retry_count += 1
+            upload.save()
+        heartbeats.Heartbeat(upload.id).stop()
+        # A partial status file makes the task continue where the transfer stopped
+        task = process_upload.apply_async((upload.id, upload.force_upload), queue=upload.queue)
+        Upload.objects.filter(id=upload.id).update(task_id=task.id)
+
 @shared_task
 def create_notification(user_id, upload_id, notification_type):
     """Create a notification for an upload."""
@@ -435,13 +827,13 @@ def create_notification(user_id, upload_id, notification_type):
         upload = Upload.objects.get(id=upload_id)
         
         # Get queue information
-        queue_info = get_queue_info_tasks()
+        queue_info = get_queue_snapshot()
         total_in_queue = queue_info['total_in_queue']
         
         # Find position in queue
         queue_position = None
         for idx, task in enumerate(queue_info['tasks']):
-            if task.get('args') and str(upload_id) in str(task['args']):
+            if task['upload_id'] == upload_id:
                 queue_position = idx + 1
                 break
         
@@ -453,8 +845,7 @@ def create_notification(user_id, upload_id, notification_type):
             message = f'Upload of {upload.folder_name} has failed.\n\n'
         else:
             title = 'Upload In Queue'
-            position_msg = f' (Position {queue_position} of {total_in_queue})' if queue_position else ''
-            message = f'Upload of {upload.folder_name} is in queue{position_msg}. {total_in_queue} total uploads in queue.'
+            message = queue_message(upload.folder_name, queue_position, total_in_queue)
         
         Notification.objects.create(
             user_id=user_id,
@@ -472,37 +863,58 @@ def test_celery(x, y):
     time.sleep(2)  # Simulate some work
     return x + y 
 
+def queue_message(folder_name, queue_position, total_in_queue):
+    position_msg = f' (Position {queue_position} of {total_in_queue})' if queue_position else ''
+    return f'Upload of {folder_name} is in queue{position_msg}. {total_in_queue} total uploads in queue.'
+
+def schedule_queue_update():
+    """Queue one update_queue_notifications run for a burst of queue transitions."""
+    try:
+        if not get_redis().set('iuw:queue-update-pending', 1, nx=True, ex=QUEUE_UPDATE_DELAY):
+            return
+        update_queue_notifications.apply_async(countdown=QUEUE_UPDATE_DELAY)
+    except Exception as e:
+        logger.error(f"Failed to schedule queue notification update: {str(e)}")
+
 @shared_task
 def update_queue_notifications():
-    """Update all queue notifications with current positions"""
+    """Update queue notifications of waiting uploads whose position changed"""
     try:
-        # Get current queue information
-        queue_info = get_queue_info_tasks()
+        # Current positions, from a single ordered query
+        queue_info = get_queue_snapshot()
         total_in_queue = queue_info['total_in_queue']
-        
-        # Get all 'submitted' uploads
-        queued_uploads = Upload.objects.filter(status='submitted')
-        
-        for upload in queued_uploads:
-            # Find position in queue
-            queue_position = None
-            for idx, task in enumerate(queue_info['tasks']):
-                if task.get('args') and str(upload.id) in str(task['args']):
-                    queue_position = idx + 1
-                    break
-            
-            # Create/update notification
-            position_msg = f' (Position {queue_position} of {total_in_queue})' if queue_position else ''
-            message = f'Upload of {upload.folder_name} is in queue{position_msg}. {total_in_queue} total uploads in queue.'
-            
-            Notification.objects.update_or_create(
-                user_id=upload.user.id,
-                related_upload=upload,
-                type='info',
-                defaults={
-                    'title': 'Upload In Queue',
-                    'message': message
-                }
-            )
+        waiting = {
+            task['upload_id']: (idx + 1, task)
+            for idx, task in enumerate(queue_info['tasks'])
+            if task['status'] == 'submitted'
+        }
+
+        existing = {}
+        for notification in Notification.objects.filter(
+                related_upload_id__in=list(waiting), type='info').order_by('id'):
+            existing.setdefault(notification.related_upload_id, notification)
+
+        to_create = []
+        to_update = []
+        for upload_id, (queue_position, task) in waiting.items():
+            message = queue_message(task['folder_name'], queue_position, total_in_queue)
+            notification = existing.get(upload_id)
+            if notification is None:
+                to_create.append(Notification(
+                    user_id=task['user_id'],
+                    related_upload_id=upload_id,
+                    type='info',
+                    title='Upload In Queue',
+                    message=message
+                ))
+            elif notification.message != message:
+                notification.message = message
+                to_update.append(notification)
+
+        if to_create:
+            Notification.objects.bulk_create(to_create)
+        if to_update:
+            Notification.objects.bulk_update(to_update, ['message'])
+        logger.info(f"Queue notifications: {len(to_create)} created, {len(to_update)} updated")
     except Exception as e:
         logger.error(f"Error updating queue notifications: {str(e)}")
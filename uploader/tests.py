@@ -1,3 +1,234 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import checkpoints, events, heartbeats, scanner, tasks
+from .models import Notification, Upload, User
+
+
+class FakeHeartbeatRedis:
+    """The sorted set commands heartbeats.py uses, kept in a dict."""
+
+    def __init__(self):
+        self.scores = {}
+
+    def zadd(self, key, mapping):
+        self.scores.update(mapping)
+
+    def zrem(self, key, member):
+        self.scores.pop(member, None)
+
+    def zrange(self, key, start, end, withscores=False):
+        return [(member.encode(), score) for member, score in self.scores.items()]
+
+
+@override_settings(UPLOAD_HEARTBEAT_TIMEOUT=0.3)
+class ReapStuckUploadsTests(TestCase):
+    def setUp(self):
+        self.redis = FakeHeartbeatRedis()
+        patches = [
+            mock.patch('uploader.heartbeats.get_redis', return_value=self.redis),
+            mock.patch('uploader.events.get_redis'),
+            mock.patch.object(tasks.current_app.control, 'revoke'),
+            mock.patch.object(tasks.process_upload, 'apply_async', return_value=mock.Mock(id='resumed')),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        user = User.objects.create(username='reaper', email='reaper@example.com')
+        self.upload = Upload.objects.create(
+            user=user, folder_name='run', status='uploading', task_id='running',
+            started_at=timezone.now() - timedelta(hours=2),
+        )
+
+    def reap(self, lease_held):
+        with mock.patch.object(tasks.upload_slots['bulk'], 'holds', return_value=lease_held):
+            tasks.reap_stuck_uploads()
+        self.upload.refresh_from_db()
+
+    def transfer(self, heartbeat, seconds):
+        """Read a file through the checkpointed reader a few bytes at a time for ``seconds``."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'S1_R1.fastq.gz')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 1000)
+        store = checkpoints.CheckpointStore(directory)
+        deadline = time.monotonic() + seconds
+        with store.transfer([path], run_id=1, heartbeat=heartbeat) as opener:
+            reader = opener(path)
+            while time.monotonic() < deadline and reader.read(1):
+                time.sleep(0.01)
+
+    def test_transfer_making_progress_is_not_reaped(self):
+        heartbeat = heartbeats.Heartbeat(self.upload.id, interval=0.05)
+        heartbeat.start()
+        self.transfer(heartbeat, 0.6)
+        self.reap(lease_held=True)
+
+        tasks.current_app.control.revoke.assert_not_called()
+        tasks.process_upload.apply_async.assert_not_called()
+        self.assertEqual(self.upload.status, 'uploading')
+
+    def test_retry_wait_is_not_reaped(self):
+        # A sample waits for its retry longer than the timeout without reading anything
+        heartbeat = heartbeats.Heartbeat(self.upload.id, interval=0.05)
+        heartbeat.start()
+        self.assertFalse(heartbeat.wait(threading.Event(), 0.6))
+        self.reap(lease_held=True)
+
+        tasks.current_app.control.revoke.assert_not_called()
+        self.assertEqual(self.upload.status, 'uploading')
+
+    def test_upload_of_dead_worker_is_resumed(self):
+        heartbeat = heartbeats.Heartbeat(self.upload.id, interval=0.05)
+        heartbeat.start()
+        self.transfer(heartbeat, 0.1)
+        # The worker died: no more reads, and the lease lapsed
+        time.sleep(0.4)
+        self.reap(lease_held=False)
+
+        tasks.current_app.control.revoke.assert_not_called()
+        tasks.process_upload.apply_async.assert_called_once_with((self.upload.id, False), queue='bulk')
+        self.assertEqual(self.upload.status, 'submitted')
+        self.assertEqual(self.upload.task_id, 'resumed')
+
+    def test_hung_transfer_holding_its_lease_is_terminated(self):
+        heartbeat = heartbeats.Heartbeat(self.upload.id, interval=0.05)
+        heartbeat.start()
+        self.transfer(heartbeat, 0.1)
+        # The connection stopped taking data: no reads, while the lease is still renewed by its thread
+        time.sleep(0.4)
+        self.reap(lease_held=True)
+
+        tasks.current_app.control.revoke.assert_called_once_with('running', terminate=True)
+        tasks.process_upload.apply_async.assert_not_called()
+        self.assertEqual(self.upload.status, 'uploading')
+
+
+class NotificationLogHandlerTests(TestCase):
+    def setUp(self):
+        patch = mock.patch('uploader.events.get_redis')
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.user = User.objects.create(username='storm', email='storm@example.com')
+        self.upload = Upload.objects.create(user=self.user, folder_name='run')
+        self.logger = logging.getLogger('uploader.tests.storm')
+        self.logger.propagate = False
+
+    def make_handler(self, **kwargs):
+        # A long interval so only the size threshold and close() flush
+        handler = tasks.NotificationLogHandler(self.upload.id, self.user.id, flush_interval=3600, **kwargs)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def inserts(self, queries):
+        return [q for q in queries if q['sql'].startswith('INSERT INTO "uploader_notification"')]
+
+    def test_error_storm_is_batched_capped_and_summarised(self):
+        handler = self.make_handler(flush_size=50, max_notifications=100, max_lines=1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(5000):
+                self.logger.info(f"Sending file {i}")
+                self.logger.error(f"Sample S{i % 500} failed")
+            self.assertLessEqual(len(handler.buffer), 1000)
+            self.assertLess(len(handler._pending), 50)
+            handler.close()
+
+        # Two full batches of 50, then the summary row; nothing for the suppressed errors
+        self.assertEqual(len(self.inserts(queries.captured_queries)), 3)
+        notifications = Notification.objects.filter(related_upload=self.upload)
+        self.assertEqual(notifications.count(), 101)
+        self.assertTrue(notifications.filter(
+            message='4900 further errors were not shown, see the upload log for details').exists())
+
+    def test_repeated_errors_are_coalesced(self):
+        handler = self.make_handler()
+
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(10):
+                self.logger.error("Connection reset")
+            handler.close()
+
+        self.assertEqual(len(self.inserts(queries.captured_queries)), 1)
+        self.assertEqual(
+            list(Notification.objects.values_list('message', flat=True)),
+            ['Connection reset (repeated 10 times)'],
+        )
+
+
+class UploadEventsTests(TestCase):
+    def setUp(self):
+        patch = mock.patch('uploader.events.get_redis')
+        self.redis = patch.start()
+        self.addCleanup(patch.stop)
+        self.user = User.objects.create(username='viewer', email='viewer@example.com')
+
+    def published(self):
+        return [json.loads(call.args[1])['event'] for call in self.redis.return_value.publish.call_args_list]
+
+    def test_save_publishes_only_changes_the_dashboard_shows(self):
+        upload = Upload.objects.create(user=self.user, folder_name='run')
+        self.redis.return_value.publish.reset_mock()
+
+        upload.bytes_transferred = 100
+        upload.save()
+        self.assertEqual(self.published(), [])
+
+        upload.sample_count = 3
+        upload.save()
+        upload.save()
+        self.assertEqual(self.published(), ['upload'])
+
+    def test_streams_are_capped_and_give_back_their_slot_when_closed(self):
+        with mock.patch.object(events, '_stream_slots', threading.BoundedSemaphore(2)):
+            first = events.open_stream(self.user.id)
+            second = events.open_stream(self.user.id)
+            self.assertIsNone(events.open_stream(self.user.id))
+
+            # Closed by the response without ever being iterated
+            first.close()
+            third = events.open_stream(self.user.id)
+            self.assertIsNotNone(third)
+            for stream in (second, third):
+                stream.close()
+
+
+class ScanDirectoryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def touch(self, *parts):
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        return path
+
+    def test_nested_mates_are_paired_whatever_their_folder_is_called(self):
+        forward = self.touch('sub_R1x', 'A_S1_R1_001.fastq.gz')
+        reverse = self.touch('sub_R1x', 'A_S1_R2_001.fastq.gz')
+        top_forward = self.touch('B_S2_R1_001.fastq.gz')
+        top_reverse = self.touch('B_S2_R2_001.fastq.gz')
+
+        result = scanner.scan_directory(self.directory)
+
+        self.assertCountEqual(result.pairs, [
+            ('A', forward, reverse),
+            ('B', os.path.basename(top_forward), os.path.basename(top_reverse)),
+        ])
+        self.assertEqual(result.orphan_forward, [])
+        self.assertEqual(result.orphan_reverse, [])
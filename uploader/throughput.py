@@ -0,0 +1,139 @@
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Upload
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+RATES_KEY = 'iuw:throughput'
+SMOOTHING = 0.2  # Weight of the newest upload in the rolling rate
+HISTORY = 50  # Completed uploads the rates are seeded from when Redis has none
+MIN_SAMPLE_BYTES = 1024 * 1024  # Smaller transfers are dominated by IRIDA round trips
+
+# Exponentially weighted moving average of bytes per second, updated atomically
+# for the overall rate and the rate of the worker host that ran the upload
+_RECORD = """
+local sample = tonumber(ARGV[1])
+for i = 3, #ARGV do
+    local old = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '')
+    local rate = sample
+    if old then
+        rate = old + tonumber(ARGV[2]) * (sample - old)
+    end
+    redis.call('HSET', KEYS[1], ARGV[i], tostring(rate))
+end
+"""
+
+
+def _host_field(host):
+    return f"host:{host}"
+
+
+def record(host, nbytes, seconds):
+    """Fold a completed transfer of ``nbytes`` taking ``seconds`` into the rolling rates."""
+    if nbytes < MIN_SAMPLE_BYTES or seconds <= 0:
+        return
+    fields = ['overall'] + ([_host_field(host)] if host else [])
+    try:
+        get_redis().eval(_RECORD, 1, RATES_KEY, nbytes / seconds, SMOOTHING, *fields)
+    except Exception as e:
+        logger.warning(f"Could not record upload throughput: {str(e)}")
+
+
+def _seed():
+    """Replay the most recent completed uploads into Redis; returns the rates."""
+    completed = (
+        Upload.objects
+        .filter(status='success', bytes_transferred__gte=MIN_SAMPLE_BYTES,
+                started_at__isnull=False, finished_at__isnull=False)
+        .order_by('-finished_at')
+        .values_list('worker_host', 'bytes_transferred', 'started_at', 'finished_at')[:HISTORY]
+    )
+    rates = {}
+    for host, nbytes, started_at, finished_at in reversed(completed):
+        seconds = (finished_at - started_at).total_seconds()
+        if seconds <= 0:
+            continue
+        rate = nbytes / seconds
+        for field in ['overall'] + ([_host_field(host)] if host else []):
+            old = rates.get(field)
+            rates[field] = rate if old is None else old + SMOOTHING * (rate - old)
+    if rates:
+        get_redis().hset(RATES_KEY, mapping=rates)
+    return rates
+
+
+def rates():
+    """Rolling upload rates in bytes per second, keyed 'overall' and 'host:<name>'."""
+    try:
+        stored = get_redis().hgetall(RATES_KEY)
+        if stored:
+            return {field.decode(): float(rate) for field, rate in stored.items()}
+        return _seed()
+    except Exception as e:
+        logger.warning(f"Could not read upload throughput: {str(e)}")
+        return {}
+
+
+def rate_for(model, host=None):
+    """Rate of ``host`` if it has completed uploads, else the overall rate; None without history."""
+    return model.get(_host_field(host)) or model.get('overall')
+
+
+def remaining_seconds(upload, model, uploaded=0, total=0):
+    """Seconds left of ``upload`` given ``uploaded`` of ``total`` samples are done; None if unknown."""
+    if not upload.total_bytes:
+        return None
+    rate = rate_for(model, upload.worker_host if upload.status == 'uploading' else None)
+    if not rate:
+        return None
+    done = uploaded / total if total else 0
+    return upload.total_bytes * (1 - min(done, 1)) / rate
+
+
+def estimate(uploads, model, limits, progress=None, now=None):
+    """Estimated finish of running and start of queued uploads, keyed by upload id.
+
+    ``uploads`` is the queue order: running uploads first, then waiting ones in
+    the order they will be dispatched. Each queue has ``limits[queue]`` slots; a
+    waiting upload starts when the first slot of its queue frees up. ``progress``
+    maps upload ids to ``(uploaded, total)`` samples of running uploads. Values
+    are ``{'estimated_start': datetime, 'eta': datetime}``, either of which is
+    None when it cannot be predicted yet.
+    """
+    now = now or timezone.now()
+    progress = progress or {}
+    free_at = {queue: [0.0] * max(1, limit) for queue, limit in limits.items()}
+    estimates = {}
+
+    for upload in uploads:
+        slots = free_at.setdefault(upload.queue, [0.0])
+        known = [i for i, free in enumerate(slots) if free is not None]
+        if upload.status == 'uploading':
+            seconds = remaining_seconds(upload, model, *progress.get(upload.id, (0, 0)))
+            estimates[upload.id] = {
+                'estimated_start': None,
+                'eta': None if seconds is None else now + timedelta(seconds=seconds),
+            }
+            if known:
+                # Uploads over the slot limit (e.g. after a limit change) share a slot
+                slot = min(known, key=slots.__getitem__)
+                slots[slot] = None if seconds is None else max(slots[slot], seconds)
+            continue
+
+        if not known:
+            # Every slot of this queue is held by an upload that cannot be predicted
+            estimates[upload.id] = {'estimated_start': None, 'eta': None}
+            continue
+        slot = min(known, key=slots.__getitem__)
+        offset = slots[slot]
+        seconds = remaining_seconds(upload, model)
+        slots[slot] = None if seconds is None else offset + seconds
+        estimates[upload.id] = {
+            'estimated_start': now + timedelta(seconds=offset),
+            'eta': None if seconds is None else now + timedelta(seconds=offset + seconds),
+        }
+    return estimates
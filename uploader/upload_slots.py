@@ -0,0 +1,102 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SLOTS_KEY = 'iuw:upload-slots'
+
+# Lease holders live in a sorted set scored by their expiry time, taken from the
+# Redis clock so worker hosts do not need synchronised clocks. Expired leases
+# are dropped before counting, so a crashed worker frees its slot on expiry.
+_ACQUIRE = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms)
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now_ms + tonumber(ARGV[3]), ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_RENEW = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not expires or tonumber(expires) <= now_ms then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now_ms + tonumber(ARGV[2]), ARGV[1])
+return 1
+"""
+
+_COUNT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_HOLDS = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if expires and tonumber(expires) > now_ms then
+    return 1
+end
+return 0
+"""
+
+
+class UploadSlots:
+    """Counting semaphore in Redis limiting concurrent IRIDA transfers across all worker hosts.
+
+    Each holder gets a lease of ``lease_seconds`` that is renewed by a heartbeat
+    thread while the transfer runs.
+    """
+
+    def __init__(self, limit, lease_seconds, renew_seconds, key=SLOTS_KEY):
+        self.limit = limit
+        self.lease_ms = int(lease_seconds * 1000)
+        self.renew_seconds = renew_seconds
+        self.key = key
+
+    def try_acquire(self, holder):
+        return bool(get_redis().eval(_ACQUIRE, 1, self.key, holder, self.limit, self.lease_ms))
+
+    def renew(self, holder):
+        return bool(get_redis().eval(_RENEW, 1, self.key, holder, self.lease_ms))
+
+    def release(self, holder):
+        get_redis().zrem(self.key, holder)
+
+    def holds(self, holder):
+        """True while ``holder`` has an unexpired lease, i.e. its worker is still alive."""
+        return bool(get_redis().eval(_HOLDS, 1, self.key, holder))
+
+    def in_use(self):
+        return int(get_redis().eval(_COUNT, 1, self.key))
+
+    @contextmanager
+    def keep_alive(self, holder):
+        """Renew the lease of ``holder`` in the background for the duration of the ``with`` block."""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.renew_seconds):
+                try:
+                    if not self.renew(holder) and not self.try_acquire(holder):
+                        logger.warning(f"Upload slot lease of {holder} expired and all slots are taken")
+                except Exception as e:
+                    logger.warning(f"Could not renew upload slot lease of {holder}: {str(e)}")
+
+        thread = threading.Thread(target=heartbeat, name=f"upload-slot-{holder}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
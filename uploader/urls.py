@@ -14,6 +14,8 @@ urlpatterns = [
     path('folders/', views.get_folders, name='get_folders'),
     path('upload/', views.upload_files, name='upload_files'),
     path('upload/<int:upload_id>/status/', views.get_upload_status, name='get_upload_status'),
+    path('upload/<int:upload_id>/logs/', views.get_upload_logs, name='get_upload_logs'),
+    path('upload/events/', views.upload_events, name='upload_events'),
     path('notifications/', views.get_notifications, name='get_notifications'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
     path('test-celery/', views.test_celery, name='test_celery'),
@@ -1,18 +1,24 @@
 from django.shortcuts import render
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from .models import Upload, Notification, User
-from . import tasks
+from . import events, folder_index, log_tail, status_file, tasks, throughput
+from datetime import timedelta
+from django.utils import timezone
 import os
 import json
 import logging
+import redis
 
 logger = logging.getLogger(__name__)
 
+FOLDER_PAGE_SIZE = 100
+
 def login_view(request):
     if request.method == 'POST':
         email = request.POST.get('email')
@@ -127,22 +133,27 @@ def dashboard(request):
 
 @login_required
 def get_folders(request):
+    """One page of the folders directly inside ``path`` of the user's upload directory.
+
+    The folder picker expands the tree one level at a time, so only the folders
+    someone opens are read.
+    """
     user_dir = request.user.get_upload_dir()
-    folders = []
-    
-    # Create the user directory if it doesn't exist
-    os.makedirs(user_dir, exist_ok=True)
-    
-    # First, add the root directory
-    folders.append('.')
-    
-    # Then walk through all subdirectories
-    for root, dirs, files in os.walk(user_dir):
-        rel_path = os.path.relpath(root, user_dir)
-        if rel_path != '.':
-            folders.append(rel_path)
-    
-    return JsonResponse({'folders': sorted(folders)})
+    try:
+        rel_path, _ = folder_index.resolve(user_dir, request.GET.get('path', '.'))
+        names = folder_index.subfolders(request.user.id, user_dir, rel_path)
+    except (ValueError, FileNotFoundError, NotADirectoryError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    paginator = Paginator(names, FOLDER_PAGE_SIZE)
+    folders_page = paginator.get_page(request.GET.get('page', 1))
+    return JsonResponse({
+        'path': rel_path,
+        'folders': [os.path.normpath(os.path.join(rel_path, name)) for name in folders_page],
+        'page': folders_page.number,
+        'num_pages': paginator.num_pages,
+        'has_next': folders_page.has_next(),
+    })
 
 @login_required
 @csrf_exempt
@@ -152,6 +163,7 @@ def upload_files(request):
             data = json.loads(request.body)
             folder_name = data.get('folder_name')
             force_upload = data.get('force_upload', False)
+            resend_all = bool(force_upload and data.get('resend_all', False))
             check_only = data.get('check_only', False)
             
             if not folder_name:
@@ -168,18 +180,13 @@ def upload_files(request):
                 return JsonResponse({'status': 'error', 'message': 'Selected folder does not exist'}, status=400)
 
             # Check for existing upload logs
-            status_file = os.path.join(folder_path, 'irida_uploader_status.info')
-            
-            if os.path.exists(status_file) and not force_upload:
+            if not force_upload:
                 try:
-                    with open(status_file, 'r') as f:
-                        status_data = json.load(f)
+                    run_status = status_file.read(folder_path)
                     
-                    sample_count = len(status_data.get('Sample Status', []))
-                    upload_status = status_data.get('Upload Status')
-                    irida_project_id = status_data.get('Project ID')
-                    
-                    if upload_status == 'complete':
+                    if run_status and run_status.status == 'complete':
+                        sample_count = run_status.total
+                        irida_project_id = run_status.project_id
                         logger.info(f"Found previous upload with {sample_count} samples")
                         return JsonResponse({
                             'status': 'warning',
@@ -195,21 +202,31 @@ def upload_files(request):
             if check_only:
                 return JsonResponse({'status': 'ok'})
 
+            # At most one upload per folder can be active, so a double click or a
+            # resubmission attaches to the upload already queued
+            if Upload.objects.filter(
+                user=request.user, folder_name=folder_name, status__in=Upload.ACTIVE_STATUSES
+            ).exists():
+                return attach_to_active_upload(request.user, folder_name, force_upload, resend_all)
+
             # Create the upload record
-            upload = Upload.objects.create(
-                user=request.user,
-                folder_name=folder_name,
-                project_name=data.get('project_name'),
-                status='submitted',
-                sample_count=0  # Will be updated during processing
-            )
-
-            # Start Celery task with force_upload parameter
+            try:
+                with transaction.atomic():
+                    upload = Upload.objects.create(
+                        user=request.user,
+                        folder_name=folder_name,
+                        project_name=data.get('project_name'),
+                        status='submitted',
+                        sample_count=0,  # Will be updated during processing
+                        force_upload=force_upload,
+                        resend_all=resend_all
+                    )
+            except IntegrityError:
+                return attach_to_active_upload(request.user, folder_name, force_upload, resend_all)
+
+            # A worker walks the folder and then queues the transfer
             logger.info(f"Starting upload process for upload_id: {upload.id}")
-            task = tasks.process_upload.delay(upload.id, force_upload)
-            logger.info(f"Celery task started with ID: {task.id}")
-            upload.task_id = task.id
-            upload.save()
+            tasks.fingerprint_upload.delay(upload.id, new=True)
 
             return JsonResponse({
                 'status': 'success',
@@ -224,6 +241,35 @@ def upload_files(request):
 
     return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
 
+def attach_to_active_upload(user, folder_name, force_upload=False, resend_all=False):
+    """Response for a submission of a folder that already has a queued or running upload."""
+    upload = Upload.objects.filter(
+        user=user, folder_name=folder_name, status__in=Upload.ACTIVE_STATUSES
+    ).first()
+    if upload is None:
+        # It finished in the meantime
+        return JsonResponse({'status': 'error', 'message': 'Please submit the folder again'}, status=409)
+
+    # Its task may already have read its options, so they cannot be changed here
+    if (force_upload and not upload.force_upload) or (resend_all and not upload.resend_all):
+        logger.info(f"Forced submission of {folder_name} refused, upload {upload.id} is not forced")
+        return JsonResponse({
+            'status': 'error',
+            'message': f'{folder_name} is already queued without forcing. '
+                       'Please submit it again once the current upload has finished.',
+            'upload_id': upload.id
+        }, status=409)
+
+    # The worker checks whether the files changed since the folder was submitted
+    tasks.fingerprint_upload.delay(upload.id)
+
+    logger.info(f"Duplicate submission of {folder_name} attached to upload {upload.id}")
+    return JsonResponse({
+        'status': 'success',
+        'upload_id': upload.id,
+        'duplicate': True
+    })
+
 @login_required
 def get_upload_status(request, upload_id):
     try:
@@ -238,41 +284,103 @@ def get_upload_status(request, upload_id):
             'total': 0
         }
         
-        status_file = os.path.join(request.user.get_upload_dir(), upload.folder_name, 'irida_uploader_status.info')
-        if os.path.exists(status_file):
-            try:
-                with open(status_file, 'r') as f:
-                    status_data = json.load(f)
-                    sample_statuses = status_data.get('Sample Status', [])
-                    sample_progress['total'] = len(sample_statuses)
-                    sample_progress['uploaded'] = sum(
-                        1 for sample in sample_statuses 
-                        if sample.get('Uploaded') == 'True'
-                    )
-            except Exception as e:
-                logger.error(f"Error reading status file for progress: {str(e)}")
-        
-        # Get IRIDA logs if they exist
-        logs = ["Log file not found"]
-        log_file = os.path.join(request.user.get_upload_dir(), upload.folder_name, 'irida-uploader.log')
-        if os.path.exists(log_file):
-            try:
-                with open(log_file, 'r') as f:
-                    logs = [line.strip() for line in f.readlines() if line.strip()]
-            except Exception as e:
-                logger.error(f"Error reading log file: {str(e)}")
+        try:
+            # Usually a cache hit, update_from_status_file has just parsed the file
+            run_status = status_file.read(os.path.join(request.user.get_upload_dir(), upload.folder_name))
+            if run_status:
+                sample_progress['total'] = run_status.total
+                sample_progress['uploaded'] = run_status.uploaded
+        except Exception as e:
+            logger.error(f"Error reading status file for progress: {str(e)}")
+
+        # Running uploads are estimated from their current progress, waiting ones from the queue
+        estimated_start = eta = None
+        if upload.status == 'uploading':
+            seconds = throughput.remaining_seconds(upload, throughput.rates(),
+                                                   sample_progress['uploaded'], sample_progress['total'])
+            if seconds is not None:
+                eta = (timezone.now() + timedelta(seconds=seconds)).isoformat()
+        elif upload.status == 'submitted':
+            for task in tasks.get_queue_snapshot()['tasks']:
+                if task['upload_id'] == upload.id:
+                    estimated_start, eta = task.get('estimated_start'), task.get('eta')
+                    break
         
         return JsonResponse({
             'status': upload.status,
-            'logs': logs,
             'irida_project_id': upload.irida_project_id or '-',
             'sample_count': upload.sample_count,
             'run_id': upload.irida_run_id,
-            'sample_progress': sample_progress
+            'sample_progress': sample_progress,
+            'estimated_start': estimated_start,
+            'eta': eta
         })
     except Upload.DoesNotExist:
         return JsonResponse({'status': 'error'}, status=404)
 
+@login_required
+def upload_events(request):
+    """Server-sent events with status, sample progress and log changes of the user's uploads.
+
+    Each response ends after a short while and the browser's EventSource reconnects.
+    An open stream holds a server thread, so each web process serves at most
+    EVENT_STREAM_LIMIT of them; further dashboards are refused and poll instead.
+    """
+    active = Upload.objects.filter(user=request.user, status__in=Upload.ACTIVE_STATUSES)
+    initial = [('upload', events.upload_snapshot(upload)) for upload in active]
+    try:
+        stream = events.open_stream(request.user.id, initial)
+    except redis.RedisError as e:
+        # A non-200 response makes the browser give up and fall back to polling
+        logger.error(f"Could not open event stream: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': 'Event stream unavailable'}, status=503)
+    if stream is None:
+        logger.info(f"Event stream limit of {settings.EVENT_STREAM_LIMIT} reached, {request.user.email} polls instead")
+        return JsonResponse({'status': 'error', 'message': 'Too many event streams'}, status=503)
+
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+@login_required
+def get_upload_logs(request, upload_id):
+    """Return IRIDA log lines written after the byte offset given in ``?offset=``.
+
+    Without an offset the end of the log is returned. Pass the returned ``offset``
+    back on the next poll to only receive new lines.
+    """
+    try:
+        upload = Upload.objects.get(id=upload_id, user=request.user)
+    except Upload.DoesNotExist:
+        return JsonResponse({'status': 'error'}, status=404)
+
+    try:
+        offset = request.GET.get('offset')
+        offset = max(0, int(offset)) if offset not in (None, '') else None
+        limit = min(int(request.GET.get('limit', log_tail.MAX_PAGE_BYTES)), log_tail.MAX_PAGE_BYTES)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid offset or limit'}, status=400)
+
+    log_file = os.path.join(request.user.get_upload_dir(), upload.folder_name, log_tail.LOG_FILE_NAME)
+    try:
+        lines, next_offset, reset, more = log_tail.read_page(log_file, offset, max(1, limit))
+    except FileNotFoundError:
+        return JsonResponse({'status': upload.status, 'lines': [], 'offset': 0, 'reset': False,
+                             'more': False, 'found': False})
+    except Exception as e:
+        logger.error(f"Error reading log file: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': 'Could not read log file'}, status=500)
+
+    return JsonResponse({
+        'status': upload.status,
+        'lines': lines,
+        'offset': next_offset,
+        'reset': reset,
+        'more': more,
+        'found': True
+    })
+
 @login_required
 def get_notifications(request):
     notifications = Notification.objects.filter(
@@ -350,8 +458,9 @@ def test_result(request, task_id):
 @login_required
 def get_queue_info(request):
     try:
-        queue_info = tasks.get_queue_info_tasks()
-        logger.info(f"Queue info: {queue_info}")  # Add logging to help debug
+        # Served from the cached snapshot, rebuilt only when an upload enters or leaves the queue
+        queue_info = tasks.get_queue_snapshot()
+        logger.debug(f"Queue info: {queue_info}")
         return JsonResponse(queue_info)
     except Exception as e:
         logger.error(f"Error getting queue info: {str(e)}")